@@ -0,0 +1,196 @@
+import asyncio
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+
+from app import metrics
+from app.auth import require_grant
+from app.grant_cache import CachedGrant
+from app.settings import settings
+
+QUEUE = "queue"
+REJECT = "reject"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+@dataclass
+class _ClientState:
+    tokens: float
+    updated: float
+    active: int = 0
+    waiters: deque[asyncio.Future] = field(default_factory=deque)
+
+    @property
+    def idle(self) -> bool:
+        return self.active == 0 and not self.waiters
+
+
+class AdmissionController:
+    """Per-client token bucket plus concurrency limit, checked before a request touches the DB.
+
+    Each (user, client) pair refills ``rate`` tokens per second up to ``burst`` and may run
+    ``max_concurrent`` requests at once (``0`` disables either limit). In ``queue`` mode a
+    request waits up to ``queue_timeout`` for a token and a slot, in arrival order; in
+    ``reject`` mode, or when the wait would be longer, it is refused with a retry delay.
+    State is per process.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_concurrent: int,
+        queue_timeout: float,
+        max_entries: int = 100_000,
+    ):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.max_entries = max_entries
+        self._clients: OrderedDict[tuple, _ClientState] = OrderedDict()
+
+    def _state(self, key: tuple) -> _ClientState:
+        state = self._clients.get(key)
+        if state is None:
+            state = self._clients[key] = _ClientState(tokens=self.burst, updated=time.monotonic())
+            self._evict()
+        self._clients.move_to_end(key)
+        return state
+
+    def _evict(self) -> None:
+        # Only idle clients are dropped; a dropped bucket simply starts out full again.
+        excess = len(self._clients) - self.max_entries
+        for key in list(self._clients):
+            if excess <= 0:
+                break
+            if self._clients[key].idle:
+                del self._clients[key]
+                excess -= 1
+
+    def _take_token(self, state: _ClientState, mode: str) -> float:
+        """Reserve one token and return how long to wait for it."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        wait = max(0.0, (1 - state.tokens) / self.rate)
+        if wait > 0 and (mode == REJECT or wait > self.queue_timeout):
+            raise AdmissionRejected(wait)
+        # Queued requests go into debt, so later arrivals wait behind them.
+        state.tokens -= 1
+        return wait
+
+    async def acquire(self, key: tuple, mode: str) -> float:
+        """Admit one request for ``key``; returns the time spent waiting."""
+        state = self._state(key)
+        wait = self._take_token(state, mode)
+        started = time.monotonic()
+        if wait:
+            await asyncio.sleep(wait)
+            # The idle state may have been evicted while sleeping.
+            state = self._state(key)
+
+        if self.max_concurrent <= 0:
+            return wait
+        if state.active < self.max_concurrent and not state.waiters:
+            state.active += 1
+            return wait
+        remaining = self.queue_timeout - (time.monotonic() - started)
+        if mode == REJECT or remaining <= 0:
+            raise AdmissionRejected(1.0)
+
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, remaining)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on.
+                self.release(key)
+            elif waiter in state.waiters:
+                state.waiters.remove(waiter)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise AdmissionRejected(1.0) from None
+            raise
+        return time.monotonic() - started
+
+    def release(self, key: tuple) -> None:
+        if self.max_concurrent <= 0:
+            return
+        state = self._clients[key]
+        # Hand the slot straight to the oldest waiter so newcomers cannot overtake the queue.
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        state.active -= 1
+
+
+admission = AdmissionController(
+    rate=settings.admission_rate_per_second,
+    burst=settings.admission_burst,
+    max_concurrent=settings.admission_max_concurrent,
+    queue_timeout=settings.admission_queue_timeout_seconds,
+)
+
+
+def route_mode(route: str) -> str:
+    return settings.admission_modes.get(route, settings.admission_default_mode)
+
+
+async def enter(request: Request, grant: CachedGrant) -> tuple[uuid.UUID, str]:
+    """Admit the request or raise 429; the caller must ``admission.release`` the returned key."""
+    route = request.scope["route"].path
+    key = (grant.user_id, grant.client_id)
+    try:
+        waited = await admission.acquire(key, route_mode(route))
+    except AdmissionRejected as exc:
+        metrics.ADMISSION_REQUESTS.inc(route, "rejected")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests for this client, retry later",
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        ) from None
+    metrics.ADMISSION_REQUESTS.inc(route, "queued" if waited else "admitted")
+    metrics.ADMISSION_WAIT_SECONDS.observe(waited, route)
+    return key
+
+
+async def admit(request: Request, grant: CachedGrant = Depends(require_grant)):
+    """Holds an admission slot for the authenticated client while the request runs.
+
+    FastAPI exits this before a ``StreamingResponse`` body is sent; streaming routes use
+    ``enter`` and ``AdmittedStreamingResponse`` instead.
+    """
+    key = await enter(request, grant)
+    try:
+        yield grant
+    finally:
+        admission.release(key)
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Streams the body while holding the admission slot ``enter`` returned, then releases it."""
+
+    def __init__(self, content, key: tuple[uuid.UUID, str], **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission_key = key
+
+    async def __call__(self, scope, receive, send) -> None:
+        # Also covers a client that disconnects before the body iterator is ever started.
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self.admission_key)
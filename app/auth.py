@@ -2,24 +2,33 @@ from datetime import datetime, timezone
 
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 
-from app.db import get_db
+from app import metrics
+from app.db import AsyncSessionLocal
+from app.grant_cache import CachedGrant, grant_cache
 from app.models import Grant
 
 security = HTTPBearer(auto_error=True)
 
 
-def require_grant(
+async def require_grant(
     request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-) -> Grant:
+) -> CachedGrant:
     token = credentials.credentials
-    grant = db.query(Grant).filter(Grant.token == token).first()
+    grant = grant_cache.get(token)
 
-    if not grant:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if grant is None:
+        with metrics.phase("auth"):
+            async with AsyncSessionLocal() as db:
+                row = (await db.scalars(select(Grant).where(Grant.token == token))).first()
+
+        if not row:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+        grant = CachedGrant.from_model(row)
+        grant_cache.put(token, grant)
 
     if grant.expires_at <= datetime.now(timezone.utc):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
@@ -27,3 +36,12 @@ def require_grant(
     request.state.user_id = grant.user_id
     request.state.client_id = grant.client_id
     return grant
+
+
+def require_scope(scope: str):
+    async def dependency(grant: CachedGrant = Depends(require_grant)) -> CachedGrant:
+        if scope not in grant.scopes:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Token lacks the '{scope}' scope")
+        return grant
+
+    return dependency
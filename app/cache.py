@@ -0,0 +1,163 @@
+import hashlib
+import importlib
+import json
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Protocol
+
+from fastapi.responses import Response
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import metrics
+from app.db import replica_engines
+from app.settings import settings
+
+_PENDING_USERS = "read_cache_pending_users"
+CACHED_HEADERS = ("ETag", "Last-Modified", "Cache-Control")
+
+
+class CacheBackend(Protocol):
+    """Storage for rendered read responses and per-user data versions.
+
+    Versions must never repeat for a user (a fresh value after eviction or restart is fine),
+    since cache keys embed them. A backend shared by all workers keeps invalidation global;
+    a per-process backend only sees writes made by its own process.
+    """
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None: ...
+
+    def version(self, user_id: uuid.UUID) -> str: ...
+
+    def bump(self, user_id: uuid.UUID) -> None: ...
+
+
+class MemoryBackend:
+    """Per-process LRU; suitable for a single worker."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._versions: OrderedDict[uuid.UUID, str] = OrderedDict()
+        # Process-unique prefix plus a counter: a version evicted and recreated never matches old keys.
+        self._epoch = uuid.uuid4().hex[:8]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next_version(self) -> str:
+        return f"{self._epoch}.{next(self._counter)}"
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            deadline, value = entry
+            if deadline <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, user_id: uuid.UUID) -> str:
+        with self._lock:
+            version = self._versions.get(user_id)
+            if version is None:
+                version = self._versions[user_id] = self._next_version()
+                while len(self._versions) > self.max_entries:
+                    self._versions.popitem(last=False)
+            else:
+                self._versions.move_to_end(user_id)
+            return version
+
+    def bump(self, user_id: uuid.UUID) -> None:
+        with self._lock:
+            self._versions[user_id] = self._next_version()
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.max_entries:
+                self._versions.popitem(last=False)
+
+
+def load_backend(spec: str) -> CacheBackend | None:
+    """``memory``, ``off``, or ``package.module:factory`` returning a backend."""
+    if spec == "off":
+        return None
+    if spec == "memory":
+        return MemoryBackend(settings.read_cache_max_entries)
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+class ReadCache:
+    """Read-through cache of JSON responses, keyed by user, data version and request.
+
+    Writers call ``invalidate_on_commit``; the user's version is bumped once the transaction
+    commits, so a read that started before the commit can only ever fill an outdated key.
+    Reads served by a replica are not stored, since the replica may not have the write yet.
+    """
+
+    def __init__(self, backend: CacheBackend | None, ttl_seconds: float) -> None:
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None and self.ttl_seconds > 0
+
+    def key(self, user_id: uuid.UUID, kind: str, request: str) -> str | None:
+        """Cache key for a read; take it *before* querying so a concurrent write makes it stale."""
+        if not self.enabled:
+            return None
+        digest = hashlib.sha256(request.encode()).hexdigest()[:32]
+        return f"{user_id}:{self.backend.version(user_id)}:{kind}:{digest}"
+
+    def get(self, key: str | None, kind: str) -> Response | None:
+        if key is None:
+            return None
+        value = self.backend.get(key)
+        metrics.READ_CACHE_REQUESTS.inc(kind, "miss" if value is None else "hit")
+        if value is None:
+            return None
+        # Stored as a JSON line of headers followed by the body (see ``set``).
+        headers, _, body = value.partition(b"\n")
+        return Response(body, media_type="application/json", headers=json.loads(headers))
+
+    def set(self, key: str | None, response: Response, db: AsyncSession) -> None:
+        # The key already carries the post-write version, so a lagging replica must not fill it.
+        if key is None or db.bind in replica_engines:
+            return
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        self.backend.set(key, json.dumps(headers).encode() + b"\n" + response.body, self.ttl_seconds)
+
+    def invalidate_on_commit(self, db: AsyncSession, user_id: uuid.UUID) -> None:
+        if self.enabled:
+            db.info.setdefault(_PENDING_USERS, set()).add(user_id)
+
+
+read_cache = ReadCache(load_backend(settings.read_cache_backend), settings.read_cache_ttl_seconds)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed(session: Session) -> None:
+    for user_id in session.info.pop(_PENDING_USERS, ()):
+        read_cache.backend.bump(user_id)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_pending(session: Session, transaction) -> None:
+    # Runs after _bump_committed on commit; on an outer rollback nothing changed.
+    if transaction.parent is None:
+        session.info.pop(_PENDING_USERS, None)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import psycopg
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+from app.crud import CLAIM_CHANNEL, CLAIM_OUT_COLUMNS
+from app.db import SHARD_URLS, shard_sessions
+from app.models import Claim
+from app.responses import claim_item, dump_json
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15.0
+# Streams end after this long so clients reconnect and re-authenticate (revoked tokens stop).
+STREAM_MAX_SECONDS = 300.0
+SUBSCRIBER_QUEUE_SIZE = 256
+LISTEN_READY_TIMEOUT = 5.0
+
+
+def _frame(event: str, data: dict[str, Any]) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dump_json(data) + b"\n\n"
+
+
+RESYNC = _frame("resync", {})
+
+
+class ClaimFeed:
+    """One LISTEN connection per shard and process, fanned out to per-user subscriber queues."""
+
+    def __init__(self, shard_urls: dict[str, str]):
+        self._conninfos = {
+            shard: make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+            for shard, url in shard_urls.items()
+        }
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._listener: asyncio.Task | None = None
+        self._connected: set[str] = set()
+        self._ready = asyncio.Event()
+
+    @asynccontextmanager
+    async def subscribe(self, user_id) -> AsyncIterator[asyncio.Queue]:
+        key = str(user_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[key].add(queue)
+        try:
+            if self._listener is None or self._listener.done():
+                self._ready.clear()
+                self._listener = asyncio.create_task(self._listen_all())
+            try:
+                await asyncio.wait_for(self._ready.wait(), LISTEN_READY_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("claim feed listener not ready; stream starts without it")
+            yield queue
+        finally:
+            self._subscribers[key].discard(queue)
+            if not self._subscribers[key]:
+                del self._subscribers[key]
+
+    async def events(self, user_id) -> AsyncIterator[bytes]:
+        """SSE frames for one user: ``ready`` first, then ``proposed`` / ``resolved`` / ``resync``."""
+        loop = asyncio.get_running_loop()
+        async with self.subscribe(user_id) as queue:
+            yield b"retry: 3000\n\n" + _frame("ready", {})
+            deadline = loop.time() + STREAM_MAX_SECONDS
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    yield await asyncio.wait_for(queue.get(), min(HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen_all(self) -> None:
+        self._connected.clear()
+        await asyncio.gather(*(self._listen(shard) for shard in self._conninfos))
+
+    async def _listen(self, shard: str) -> None:
+        backoff = 1.0
+        missed = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self._conninfos[shard], autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {CLAIM_CHANNEL}")
+                    self._connected.add(shard)
+                    if len(self._connected) == len(self._conninfos):
+                        self._ready.set()
+                    backoff = 1.0
+                    if missed:
+                        # Notifications sent while disconnected are lost; make everyone reload.
+                        self._broadcast(RESYNC)
+                        missed = False
+                    async for notify in conn.notifies():
+                        await self._dispatch(shard, notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("claim feed listener for shard %s failed; reconnecting in %.0fs", shard, backoff)
+                self._connected.discard(shard)
+                self._ready.clear()
+                missed = True
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def _dispatch(self, shard: str, payload: str) -> None:
+        message = json.loads(payload)
+        user_id = message["user_id"]
+        if user_id not in self._subscribers:
+            return
+
+        event = message["event"]
+        if event == "proposed":
+            claims = await self._load_proposed(shard, user_id, message["ids"])
+            if not claims:
+                return
+            frame = _frame("proposed", {"claims": claims})
+        elif event == "resync":
+            frame = RESYNC
+        else:
+            frame = _frame("resolved", {"status": event, "ids": message["ids"]})
+        self._broadcast(frame, user_id)
+
+    async def _load_proposed(self, shard: str, user_id: str, ids: list[str]) -> list[dict[str, Any]]:
+        # The notification came from the shard that holds the claims.
+        async with shard_sessions[shard]() as db:
+            rows = await db.execute(
+                select(*CLAIM_OUT_COLUMNS)
+                .where(Claim.user_id == user_id, Claim.id.in_(ids), Claim.status == "proposed")
+                .order_by(Claim.created_at, Claim.id)
+            )
+            return [claim_item(row) for row in rows]
+
+    def _broadcast(self, frame: bytes, user_id: str | None = None) -> None:
+        if user_id is None:
+            queues = [q for subscribers in self._subscribers.values() for q in subscribers]
+        else:
+            queues = list(self._subscribers.get(user_id, ()))
+        for queue in queues:
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # A slow reader has fallen behind; drop its backlog and make it reload.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+
+claim_feed = ClaimFeed(SHARD_URLS)
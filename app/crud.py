@@ -1,127 +1,949 @@
-from datetime import datetime, timezone
+import json
+import uuid
+from collections.abc import AsyncIterator, Sequence
+from datetime import datetime, timedelta, timezone
 from typing import Any
 
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    Integer,
+    Row,
+    Text,
+    and_,
+    bindparam,
+    case,
+    column,
+    delete,
+    func,
+    insert,
+    literal,
+    null,
+    select,
+    text,
+    true,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.models import Claim, Entity
+from app.cache import read_cache
+from app.models import Claim, ClaimHistory, Entity, EntityKey, IdempotencyKey
+from app.pagination import decode_cursor, encode_cursor
+from app.schemas import QueryRequest, WriteRequest
+from app.search import match_clause, searchable, similarity_rank, sql_literal
+from app.settings import settings
 
 
-def search_entities(db: Session, user_id, q: str, entity_type: str | None, max_results: int) -> list[Entity]:
-    query = db.query(Entity).filter(Entity.user_id == user_id)
+MATCH_KEY_FIELDS: dict[str, tuple[str, ...]] = {
+    "contact": ("email", "name"),
+    "preference": ("name",),
+    "goal": ("title", "name"),
+}
+KEY_FIELD_NAMES = sorted({field for fields in MATCH_KEY_FIELDS.values() for field in fields})
+
+WRITE_ATTEMPTS = 3
+
+# LISTEN/NOTIFY channel for claim events (see app.claim_feed); payloads stay well under 8000 bytes.
+CLAIM_CHANNEL = "claim_events"
+NOTIFY_IDS_PER_MESSAGE = 100
+
+# Response endpoints select these as plain rows rather than loading ORM objects.
+ENTITY_OUT_COLUMNS = (Entity.id, Entity.type, Entity.data)
+CLAIM_OUT_COLUMNS = (
+    Claim.id,
+    Claim.user_id,
+    Claim.client_id,
+    Claim.entity_id,
+    Claim.entity_type,
+    Claim.field,
+    Claim.old_value,
+    Claim.new_value,
+    Claim.status,
+    Claim.created_at,
+    Claim.confirmed_at,
+)
+
+
+class ConcurrentUpdateError(Exception):
+    """An entity kept changing underneath a write; the client should retry."""
 
-    if entity_type:
-        query = query.filter(Entity.type == entity_type)
 
-    pattern = f"%{q}%"
-    query = query.filter(
-        or_(
-            Entity.data["name"].astext.ilike(pattern),
-            Entity.data["org"].astext.ilike(pattern),
+class _StaleEntity(Exception):
+    pass
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def notify_claims(db: AsyncSession, user_id, event: str, claim_ids: Sequence = ()) -> None:
+    """Queue claim events; Postgres only delivers them if the surrounding transaction commits."""
+    ids = [str(claim_id) for claim_id in claim_ids]
+    if not ids and event != "resync":
+        return
+    payloads = [
+        json.dumps({"user_id": str(user_id), "event": event, "ids": ids[start : start + NOTIFY_IDS_PER_MESSAGE]})
+        for start in range(0, max(len(ids), 1), NOTIFY_IDS_PER_MESSAGE)
+    ]
+    await db.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {"channel": CLAIM_CHANNEL, "payloads": payloads},
+    )
+
+
+def _status_is(status: str):
+    # A literal (not a bind parameter) so prepared generic plans can still use the partial
+    # ``status = 'proposed'`` indexes.
+    return Claim.status == sql_literal(status)
+
+
+def _projected_data(fields: Sequence[str]):
+    # Only keys present in the document are copied, so missing fields stay absent rather than null.
+    parts = [
+        case(
+            (Entity.data.has_key(field), func.jsonb_build_object(literal(field, Text), Entity.data[field], type_=JSONB)),
+            else_=literal({}, JSONB),
+        )
+        for field in dict.fromkeys(fields)
+    ]
+    projected = parts[0]
+    for part in parts[1:]:
+        projected = projected.op("||", return_type=JSONB)(part)
+    return projected
+
+
+def entity_columns(fields: Sequence[str] | None = None) -> tuple:
+    """Response columns for entities; ``fields`` trims ``data`` to those keys in SQL."""
+    if not fields:
+        return ENTITY_OUT_COLUMNS
+    return Entity.id, Entity.type, _projected_data(fields).label("data")
+
+
+def _search_filter(user_id, q: str, entity_type: str | None, mode: str):
+    """``(where, order_by)`` for one search; callers check ``searchable`` first."""
+    if mode == "fuzzy":
+        matched = match_clause(entity_type, lambda column: column.op("%")(q))
+    else:
+        pattern = f"{_escape_like(q)}%" if mode == "prefix" else f"%{_escape_like(q)}%"
+        matched = match_clause(entity_type, lambda column: column.ilike(pattern, escape="\\"))
+
+    rank = similarity_rank(entity_type, q)
+    return and_(Entity.user_id == user_id, matched), (rank.desc(), Entity.updated_at.desc())
+
+
+async def search_entities(
+    db: AsyncSession,
+    user_id,
+    q: str,
+    entity_type: str | None,
+    max_results: int,
+    mode: str = "substring",
+    fields: Sequence[str] | None = None,
+) -> list[Row]:
+    if not searchable(entity_type):
+        return []
+
+    where, ordering = _search_filter(user_id, q, entity_type, mode)
+    result = await db.execute(select(*entity_columns(fields)).where(where).order_by(*ordering).limit(max_results))
+    return list(result.all())
+
+
+async def search_entities_batch(db: AsyncSession, user_id, queries: Sequence[QueryRequest]) -> list[list[Row]]:
+    """Run many searches as one UNION ALL statement; results are returned in request order."""
+    parts = []
+    for idx, query in enumerate(queries):
+        if not searchable(query.entity_type):
+            continue
+        where, ordering = _search_filter(user_id, query.q, query.entity_type, query.mode)
+        parts.append(
+            select(
+                *entity_columns(query.fields),
+                literal(idx, Integer).label("query_idx"),
+                func.row_number().over(order_by=ordering).label("position"),
+            )
+            .where(where)
+            .order_by(*ordering)
+            .limit(query.max_results)
+        )
+
+    results: list[list[Row]] = [[] for _ in queries]
+    if not parts:
+        return results
+
+    combined = union_all(*parts).subquery()
+    rows = await db.execute(
+        select(combined.c.id, combined.c.type, combined.c.data, combined.c.query_idx).order_by(
+            combined.c.query_idx, combined.c.position
         )
     )
+    for row in rows:
+        results[row.query_idx].append(row)
+    return results
+
+
+def _normalize_key_value(value: Any) -> str:
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def match_key(entity_type: str, match: dict[str, Any]) -> tuple[str | None, dict[str, Any]]:
+    """Split ``match`` into the identity key to probe and the remaining containment filter."""
+    for field in MATCH_KEY_FIELDS.get(entity_type, ()):
+        value = match.get(field)
+        if value is None or value == "":
+            continue
+        rest = {k: v for k, v in match.items() if k != field}
+        return f"{field}:{_normalize_key_value(value)}", rest
+    return None, match
+
+
+def match_keys(entity_type: str, data: dict[str, Any]) -> list[str]:
+    """Every identity key ``data`` holds: one per non-empty identity field."""
+    return [
+        f"{field}:{_normalize_key_value(data[field])}"
+        for field in MATCH_KEY_FIELDS.get(entity_type, ())
+        if not _is_empty(data, field)
+    ]
+
+
+def _touches_key(entity_type: str, fields) -> bool:
+    return not set(MATCH_KEY_FIELDS.get(entity_type, ())).isdisjoint(fields)
+
 
-    return query.order_by(Entity.updated_at.desc()).limit(max_results).all()
+def _key_rows(user_id, entities) -> list[dict[str, Any]]:
+    return [
+        {"user_id": user_id, "type": entity_type, "key": key, "entity_id": entity_id}
+        for entity_id, entity_type, data in entities
+        for key in match_keys(entity_type, data)
+    ]
 
 
-def find_or_create_entity(db: Session, user_id, entity_type: str, match: dict[str, Any]) -> Entity:
-    query = db.query(Entity).filter(Entity.user_id == user_id, Entity.type == entity_type)
+async def _add_match_keys(db: AsyncSession, user_id, entities) -> set[tuple[Any, str]]:
+    """Key ``(id, type, data)`` entities; returns the ``(id, key)`` pairs that were free to take."""
+    rows = _key_rows(user_id, entities)
+    if not rows:
+        return set()
+    result = await db.execute(
+        pg_insert(EntityKey).on_conflict_do_nothing().returning(EntityKey.entity_id, EntityKey.key), rows
+    )
+    return {tuple(row) for row in result}
+
+
+async def sync_match_keys(db: AsyncSession, user_id, entities) -> None:
+    """Bring ``entity_keys`` in line with ``(id, type, data)`` rows whose identity fields changed.
+
+    Keys the data no longer holds are dropped. A new key already held by another entity stays
+    with that entity; this one is then found through its other keys or by containment.
+    """
+    entities = list(entities)
+    if not entities:
+        return
+    rows = _key_rows(user_id, entities)
+    stale = delete(EntityKey).where(EntityKey.entity_id.in_([entity_id for entity_id, _, _ in entities]))
+    if rows:
+        stale = stale.where(tuple_(EntityKey.entity_id, EntityKey.key).not_in([(r["entity_id"], r["key"]) for r in rows]))
+    await db.execute(stale)
+    await _add_match_keys(db, user_id, entities)
+
+
+async def _find_by_match_key(db: AsyncSession, user_id, entity_type: str, key: str, rest: dict[str, Any]) -> Entity | None:
+    stmt = (
+        select(Entity)
+        .join(EntityKey, EntityKey.entity_id == Entity.id)
+        .where(EntityKey.user_id == user_id, EntityKey.type == entity_type, EntityKey.key == key)
+    )
+    if rest:
+        stmt = stmt.where(Entity.data.contains(rest))
+    return (await db.scalars(stmt)).first()
+
+
+async def find_or_create_entity(db: AsyncSession, user_id, entity_type: str, match: dict[str, Any]) -> Entity:
+    key, rest = match_key(entity_type, match)
+    if key:
+        entity = await _find_by_match_key(db, user_id, entity_type, key, rest)
+        if entity:
+            return entity
+
+    stmt = select(Entity).where(Entity.user_id == user_id, Entity.type == entity_type)
     if match:
-        query = query.filter(Entity.data.contains(match))
+        stmt = stmt.where(Entity.data.contains(match))
 
-    entity = query.order_by(Entity.updated_at.desc()).first()
+    entity = (await db.scalars(stmt.order_by(Entity.updated_at.desc()).limit(1))).first()
     if entity:
         return entity
 
+    read_cache.invalidate_on_commit(db, user_id)
+    if key:
+        async with db.begin_nested() as savepoint:
+            entity = Entity(user_id=user_id, type=entity_type, data=dict(match))
+            db.add(entity)
+            await db.flush()
+            if (entity.id, key) in await _add_match_keys(db, user_id, [(entity.id, entity_type, entity.data)]):
+                return entity
+            # Either a concurrent writer created the same entity, or the key belongs to an
+            # entity that does not satisfy the rest of the match.
+            await savepoint.rollback()
+        existing = await _find_by_match_key(db, user_id, entity_type, key, rest)
+        if existing:
+            return existing
+
     entity = Entity(user_id=user_id, type=entity_type, data=dict(match))
     db.add(entity)
-    db.flush()
+    await db.flush()
+    await _add_match_keys(db, user_id, [(entity.id, entity_type, entity.data)])
     return entity
 
 
-def write_with_claims(db: Session, user_id, client_id: str, entity: Entity, patch: dict[str, Any]):
-    applied: list[str] = []
-    proposed: list[dict[str, Any]] = []
+def _is_empty(data: dict[str, Any], field: str) -> bool:
+    value = data.get(field)
+    return field not in data or value is None or value == ""
 
-    data = dict(entity.data or {})
+
+def _plan_patch(data: dict[str, Any], patch: dict[str, Any]) -> tuple[list[str], list[dict[str, Any]]]:
+    """Apply ``patch`` to ``data`` in place and return the applied fields and claim specs."""
+    applied: list[str] = []
+    claims: list[dict[str, Any]] = []
 
     for field, new_value in patch.items():
         current_value = data.get(field)
-        is_empty = field not in data or current_value is None or current_value == ""
 
-        if is_empty:
+        if _is_empty(data, field):
             data[field] = new_value
             applied.append(field)
-            claim = Claim(
-                user_id=user_id,
-                client_id=client_id,
-                entity_id=entity.id,
-                entity_type=entity.type,
-                field=field,
-                old_value=current_value,
-                new_value=new_value,
-                status="applied",
-            )
-            db.add(claim)
+            claims.append({"field": field, "old_value": current_value, "new_value": new_value, "status": "applied"})
             continue
 
         if current_value != new_value:
-            claim = Claim(
+            claims.append({"field": field, "old_value": current_value, "new_value": new_value, "status": "proposed"})
+
+    return applied, claims
+
+
+def _proposed_fields(claims: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    return [
+        {"field": c["field"], "claim_id": c["id"], "current": c["old_value"], "new": c["new_value"]}
+        for c in claims
+        if c["status"] == "proposed"
+    ]
+
+
+def _fill_empty(patch: dict[str, Any]):
+    """SQL for ``data`` with each patch field set only where it is missing, null or ""."""
+    pairs = []
+    for field, value in patch.items():
+        current = Entity.data[sql_literal(field)]
+        is_empty = func.coalesce(Entity.data[sql_literal(field)].astext, "") == ""
+        pairs += [literal(field, Text), case((is_empty, literal(value, JSONB)), else_=current)]
+    return Entity.data.op("||")(func.jsonb_build_object(*pairs))
+
+
+def _value_key(value: Any) -> str:
+    return json.dumps(value, sort_keys=True)
+
+
+async def _assign_claim_ids(db: AsyncSession, claims: list[tuple[Any, dict[str, Any]]]) -> list[tuple[Any, dict[str, Any]]]:
+    """Give each ``(entity_id, spec)`` an id and return the pairs that still need inserting.
+
+    A proposal identical to a pending one (same entity, field and value) reuses that claim
+    instead of adding another. Callers hold the entities' row locks from the version-guarded
+    update, so concurrent writers cannot both miss the same pending claim.
+    """
+    proposed = {(entity_id, spec["field"]) for entity_id, spec in claims if spec["status"] == "proposed"}
+    pending: dict[tuple[Any, str, str], uuid.UUID] = {}
+    if proposed:
+        rows = await db.execute(
+            select(Claim.id, Claim.entity_id, Claim.field, Claim.new_value).where(
+                _status_is("proposed"), tuple_(Claim.entity_id, Claim.field).in_(proposed)
+            )
+        )
+        for claim_id, entity_id, field, new_value in rows:
+            pending.setdefault((entity_id, field, _value_key(new_value)), claim_id)
+
+    inserts = []
+    for entity_id, spec in claims:
+        key = (entity_id, spec["field"], _value_key(spec["new_value"]))
+        if spec["status"] == "proposed" and key in pending:
+            spec["id"] = pending[key]
+            continue
+        spec["id"] = uuid.uuid4()
+        if spec["status"] == "proposed":
+            pending[key] = spec["id"]
+        inserts.append((entity_id, spec))
+    return inserts
+
+
+async def write_with_claims(db: AsyncSession, user_id, client_id: str, entity: Entity, patch: dict[str, Any]):
+    for _ in range(WRITE_ATTEMPTS):
+        data = dict(entity.data or {})
+        applied, claims = _plan_patch(data, patch)
+        if not claims:
+            # Nothing to fill or propose: the row, its version and cached reads stay as they are.
+            return applied, []
+        now = datetime.now(timezone.utc)
+
+        if applied:
+            changes: dict[str, Any] = {
+                "data": _fill_empty({field: patch[field] for field in applied}),
+                "version": Entity.version + 1,
+                "updated_at": now,
+            }
+
+            # Only the patched fields travel to the database; the version guard turns a
+            # concurrent change into a re-read instead of a lost update.
+            version = await db.scalar(
+                update(Entity)
+                .where(Entity.id == entity.id, Entity.version == entity.version)
+                .values(**changes)
+                .returning(Entity.version)
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            # Proposals only: lock the row at the version they were planned against, without
+            # bumping it, so the claims' old values are current and dedup sees a stable row.
+            version = await db.scalar(
+                select(Entity.version)
+                .where(Entity.id == entity.id, Entity.version == entity.version)
+                .with_for_update()
+            )
+        if version is not None:
+            break
+        await db.refresh(entity)
+    else:
+        raise ConcurrentUpdateError(entity.id)
+
+    if applied:
+        if _touches_key(entity.type, applied):
+            await sync_match_keys(db, user_id, [(entity.id, entity.type, data)])
+        set_committed_value(entity, "data", data)
+        set_committed_value(entity, "version", version)
+        set_committed_value(entity, "updated_at", now)
+        read_cache.invalidate_on_commit(db, user_id)
+
+    inserts = await _assign_claim_ids(db, [(entity.id, spec) for spec in claims])
+    for _, spec in inserts:
+        db.add(
+            Claim(
                 user_id=user_id,
                 client_id=client_id,
                 entity_id=entity.id,
                 entity_type=entity.type,
-                field=field,
-                old_value=current_value,
-                new_value=new_value,
-                status="proposed",
+                **spec,
             )
-            db.add(claim)
-            db.flush()
-            proposed.append(
-                {
-                    "field": field,
-                    "claim_id": claim.id,
-                    "current": current_value,
-                    "new": new_value,
-                }
+        )
+
+    await db.flush()
+    await notify_claims(db, user_id, "proposed", [spec["id"] for _, spec in inserts if spec["status"] == "proposed"])
+
+    return applied, _proposed_fields(claims)
+
+
+async def _resolve_batch_matches(db: AsyncSession, user_id, items: list[WriteRequest]) -> list[Entity | None]:
+    keys = [match_key(item.entity_type, item.match) for item in items]
+    resolved: list[Entity | None] = [None] * len(items)
+
+    probes = {(item.entity_type, key) for item, (key, _) in zip(items, keys) if key}
+    if probes:
+        candidates = await db.execute(
+            select(EntityKey.type, EntityKey.key, Entity)
+            .join(Entity, Entity.id == EntityKey.entity_id)
+            .where(EntityKey.user_id == user_id, tuple_(EntityKey.type, EntityKey.key).in_(probes))
+            .execution_options(populate_existing=True)
+        )
+        by_key = {(entity_type, key): entity for entity_type, key, entity in candidates}
+        for i, (item, (key, rest)) in enumerate(zip(items, keys)):
+            entity = by_key.get((item.entity_type, key)) if key else None
+            if entity and _contains(entity.data, rest):
+                resolved[i] = entity
+
+    missing = [i for i, entity in enumerate(resolved) if entity is None]
+    if missing:
+        wanted = values(
+            column("idx", Integer),
+            column("type", Text),
+            column("match", JSONB),
+            name="wanted",
+        ).data([(i, items[i].entity_type, items[i].match) for i in missing])
+        best = (
+            select(Entity.id)
+            .where(
+                Entity.user_id == user_id,
+                Entity.type == wanted.c.type,
+                Entity.data.contains(wanted.c.match),
             )
+            .order_by(Entity.updated_at.desc())
+            .limit(1)
+            .correlate(wanted)
+            .lateral("best")
+        )
+        found = await db.execute(
+            select(wanted.c.idx, Entity)
+            .select_from(wanted)
+            .join(best, true())
+            .join(Entity, Entity.id == best.c.id)
+            .execution_options(populate_existing=True)
+        )
+        for idx, entity in found:
+            resolved[idx] = entity
+
+    return resolved
+
+
+def _contains(data: Any, subset: Any) -> bool:
+    if isinstance(subset, dict):
+        return isinstance(data, dict) and all(k in data and _contains(data[k], v) for k, v in subset.items())
+    if isinstance(subset, list):
+        return isinstance(data, list) and all(any(_contains(d, v) for d in data) for v in subset)
+    return data == subset
+
+
+async def _create_batch_entities(db: AsyncSession, user_id, items: list[WriteRequest], resolved: list[Entity | None]) -> None:
+    pending: dict[tuple[str, str], list[int]] = {}
+    for i, item in enumerate(items):
+        if resolved[i] is None:
+            pending.setdefault((item.entity_type, json.dumps(item.match, sort_keys=True)), []).append(i)
+    if not pending:
+        return
+
+    now = datetime.now(timezone.utc)
+    groups = list(pending.values())
+
+    def new_rows(group_indexes):
+        return [
+            {
+                "id": uuid.uuid4(),
+                "user_id": user_id,
+                "type": items[groups[n][0]].entity_type,
+                "data": dict(items[groups[n][0]].match),
+                "created_at": now,
+                "updated_at": now,
+            }
+            for n in group_indexes
+        ]
+
+    async def create(rows):
+        created = {e.id: e for e in await db.scalars(insert(Entity).returning(Entity), rows)}
+        taken = await _add_match_keys(db, user_id, [(row["id"], row["type"], row["data"]) for row in rows])
+        return created, taken
+
+    rows = new_rows(range(len(groups)))
+    created, taken = await create(rows)
+
+    probe_keys = [match_key(items[group[0]].entity_type, items[group[0]].match)[0] for group in groups]
+    conflicted = [n for n, key in enumerate(probe_keys) if key and (rows[n]["id"], key) not in taken]
+    if conflicted:
+        # Same handling as find_or_create_entity: the key may have been taken by a concurrent
+        # writer or another spelling earlier in the batch (re-resolve), or by an entity that
+        # fails the rest of the match (create one that goes without that key).
+        dropped = [created.pop(rows[n]["id"]).id for n in conflicted]
+        await db.execute(delete(EntityKey).where(EntityKey.entity_id.in_(dropped)))
+        await db.execute(delete(Entity).where(Entity.id.in_(dropped)))
+        retry = [i for n in conflicted for i in groups[n]]
+        for i, entity in zip(retry, await _resolve_batch_matches(db, user_id, [items[i] for i in retry])):
+            resolved[i] = entity
+        unresolved = [n for n in conflicted if resolved[groups[n][0]] is None]
+        if unresolved:
+            for n, row in zip(unresolved, new_rows(unresolved)):
+                rows[n] = row
+            created.update((await create([rows[n] for n in unresolved]))[0])
 
-    entity.data = data
-    entity.updated_at = datetime.now(timezone.utc)
-    db.flush()
+    for row, group in zip(rows, groups):
+        if row["id"] in created:
+            for i in group:
+                resolved[i] = created[row["id"]]
 
-    return applied, proposed
 
+async def _write_batch_once(db: AsyncSession, user_id, client_id: str, items: list[WriteRequest]):
+    resolved = await _resolve_batch_matches(db, user_id, items)
+    await _create_batch_entities(db, user_id, items, resolved)
 
-def list_claims(db: Session, user_id, status: str) -> list[Claim]:
-    return (
-        db.query(Claim)
-        .filter(Claim.user_id == user_id, Claim.status == status)
-        .order_by(Claim.created_at.desc())
-        .all()
+    now = datetime.now(timezone.utc)
+    documents: dict[Any, dict[str, Any]] = {}
+    patches: dict[Any, dict[str, Any]] = {}
+    versions: dict[Any, int] = {}
+    planned = []
+
+    for item, entity in zip(items, resolved):
+        data = documents.setdefault(entity.id, dict(entity.data or {}))
+        versions[entity.id] = entity.version
+        applied, claims = _plan_patch(data, item.patch)
+        patches.setdefault(entity.id, {}).update({field: item.patch[field] for field in applied})
+        planned.append((entity, applied, claims))
+
+    # Entities with nothing filled keep their version; those that only get proposals are locked
+    # at the version the proposals were planned against.
+    patches = {entity_id: patch for entity_id, patch in patches.items() if patch}
+    proposing = {entity.id for entity, applied, claims in planned if claims} - patches.keys()
+
+    if patches:
+        entities = Entity.__table__
+        result = await db.execute(
+            update(entities)
+            .where(entities.c.id == bindparam("b_id"), entities.c.version == bindparam("b_version"))
+            .values(
+                data=entities.c.data.op("||")(bindparam("b_patch", type_=JSONB)),
+                version=entities.c.version + 1,
+                updated_at=now,
+            ),
+            [
+                {"b_id": entity_id, "b_version": versions[entity_id], "b_patch": patch}
+                for entity_id, patch in patches.items()
+            ],
+        )
+        if result.rowcount != len(patches):
+            raise _StaleEntity()
+        types = {entity.id: entity.type for entity in resolved}
+        await sync_match_keys(
+            db,
+            user_id,
+            [
+                (entity_id, types[entity_id], documents[entity_id])
+                for entity_id, patch in patches.items()
+                if _touches_key(types[entity_id], patch)
+            ],
+        )
+    if proposing:
+        locked = await db.scalars(
+            select(Entity.id)
+            .where(tuple_(Entity.id, Entity.version).in_([(entity_id, versions[entity_id]) for entity_id in proposing]))
+            .order_by(Entity.id)
+            .with_for_update()
+        )
+        if len(locked.all()) != len(proposing):
+            raise _StaleEntity()
+
+    inserts = await _assign_claim_ids(db, [(entity.id, spec) for entity, _, claims in planned for spec in claims])
+    types = {entity.id: entity.type for entity in resolved}
+    claim_rows = [
+        {
+            **spec,
+            "user_id": user_id,
+            "client_id": client_id,
+            "entity_id": entity_id,
+            "entity_type": types[entity_id],
+            "created_at": now,
+        }
+        for entity_id, spec in inserts
+    ]
+    if claim_rows:
+        await db.execute(insert(Claim).returning(Claim.id), claim_rows)
+
+    for entity in {entity.id: entity for entity in resolved if entity.id in patches}.values():
+        set_committed_value(entity, "data", documents[entity.id])
+        set_committed_value(entity, "version", versions[entity.id] + 1)
+        set_committed_value(entity, "updated_at", now)
+
+    results = [(entity.id, applied, _proposed_fields(claims)) for entity, applied, claims in planned]
+    return results, [row["id"] for row in claim_rows if row["status"] == "proposed"]
+
+
+async def write_batch(db: AsyncSession, user_id, client_id: str, items: list[WriteRequest]):
+    """Apply many writes with a constant number of statements; returns one result per item."""
+    for _ in range(WRITE_ATTEMPTS):
+        try:
+            async with db.begin_nested():
+                results, proposed = await _write_batch_once(db, user_id, client_id, items)
+        except _StaleEntity:
+            continue
+        await notify_claims(db, user_id, "proposed", proposed)
+        read_cache.invalidate_on_commit(db, user_id)
+        return results
+    raise ConcurrentUpdateError()
+
+
+async def reserve_idempotency_key(db: AsyncSession, user_id, key: str, request_hash: str):
+    """Claim ``key`` for this request, or return ``(stored_response, error)`` from an earlier one.
+
+    The reservation is a row in the caller's transaction: a concurrent request with the same key
+    blocks on it and then replays whatever the first one committed. Expired keys are reused.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.idempotency_ttl_seconds)
+    stmt = pg_insert(IdempotencyKey).values(
+        user_id=user_id, key=key, request_hash=request_hash, created_at=datetime.now(timezone.utc)
     )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+        set_={"request_hash": stmt.excluded.request_hash, "response": null(), "created_at": stmt.excluded.created_at},
+        where=IdempotencyKey.created_at < cutoff,
+    )
+    for _ in range(WRITE_ATTEMPTS):
+        if (await db.execute(stmt.returning(IdempotencyKey.key))).first():
+            return None, None
 
+        stored = (
+            await db.execute(
+                select(IdempotencyKey.request_hash, IdempotencyKey.response).where(
+                    IdempotencyKey.user_id == user_id, IdempotencyKey.key == key
+                )
+            )
+        ).one_or_none()
+        if stored is None:
+            # The retention purge deleted the row between the two statements; reserve afresh.
+            continue
+        if stored.request_hash != request_hash:
+            return None, "Idempotency-Key was already used for a different request"
+        return stored.response, None
+    raise ConcurrentUpdateError()
 
-def confirm_claim(db: Session, user_id, claim_id):
-    claim = db.query(Claim).filter(Claim.id == claim_id, Claim.user_id == user_id).first()
-    if not claim:
-        return None, "not_found"
 
-    if claim.status != "proposed":
-        return None, "invalid_status"
+async def store_idempotent_response(db: AsyncSession, user_id, key: str, response: dict[str, Any]) -> None:
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        .values(response=response)
+    )
+
+
+async def list_entities(
+    db: AsyncSession,
+    user_id,
+    entity_type: str | None,
+    limit: int,
+    cursor: str | None = None,
+    fields: Sequence[str] | None = None,
+) -> tuple[list[Row], str | None]:
+    stmt = select(*entity_columns(fields), Entity.version, Entity.updated_at).where(Entity.user_id == user_id)
+    if entity_type:
+        stmt = stmt.where(Entity.type == entity_type)
+    if cursor:
+        stmt = stmt.where(tuple_(Entity.updated_at, Entity.id) < tuple_(*decode_cursor(cursor)))
+
+    stmt = stmt.order_by(Entity.updated_at.desc(), Entity.id.desc()).limit(limit + 1)
+    entities = list((await db.execute(stmt)).all())
+    if len(entities) <= limit:
+        return entities, None
+    entities = entities[:limit]
+    return entities, encode_cursor(entities[-1].updated_at, entities[-1].id)
+
+
+async def list_claims(
+    db: AsyncSession,
+    user_id,
+    status: str,
+    limit: int,
+    cursor: str | None = None,
+) -> tuple[list[Row], str | None]:
+    stmt = select(*CLAIM_OUT_COLUMNS).where(Claim.user_id == user_id, _status_is(status))
+    if cursor:
+        stmt = stmt.where(tuple_(Claim.created_at, Claim.id) < tuple_(*decode_cursor(cursor)))
+
+    stmt = stmt.order_by(Claim.created_at.desc(), Claim.id.desc()).limit(limit + 1)
+    claims = list((await db.execute(stmt)).all())
+    if len(claims) <= limit:
+        return claims, None
+    claims = claims[:limit]
+    return claims, encode_cursor(claims[-1].created_at, claims[-1].id)
+
+
+def _is_stale(data: dict[str, Any], claim) -> bool:
+    # The field changed after the claim was proposed; confirming it would overwrite a newer value.
+    return data.get(claim.field) != claim.old_value
 
-    entity = db.query(Entity).filter(Entity.id == claim.entity_id, Entity.user_id == user_id).first()
-    if not entity:
-        return None, "entity_not_found"
 
-    data = dict(entity.data or {})
-    data[claim.field] = claim.new_value
-    entity.data = data
-    entity.updated_at = datetime.now(timezone.utc)
+async def confirm_claim(db: AsyncSession, user_id, claim_id):
+    now = datetime.now(timezone.utc)
+    claim = (
+        await db.execute(
+            select(Claim.id, Claim.entity_id, Claim.field, Claim.old_value, Claim.new_value)
+            .where(Claim.id == claim_id, Claim.user_id == user_id, _status_is("proposed"))
+            .with_for_update()
+        )
+    ).first()
+    if not claim:
+        current = await db.scalar(select(Claim.status).where(Claim.id == claim_id, Claim.user_id == user_id))
+        return None, "not_found" if current is None else "invalid_status"
+
+    data = await db.scalar(
+        select(Entity.data).where(Entity.id == claim.entity_id, Entity.user_id == user_id).with_for_update()
+    )
+    if data is None:
+        return None, "entity_not_found"
+    if _is_stale(data, claim):
+        return None, "stale"
 
-    claim.status = "confirmed"
-    claim.confirmed_at = datetime.now(timezone.utc)
+    await db.execute(update(Claim).where(Claim.id == claim.id).values(status="confirmed", confirmed_at=now))
+    entity = await db.scalar(
+        update(Entity)
+        .where(Entity.id == claim.entity_id, Entity.user_id == user_id)
+        .values(
+            data=Entity.data.op("||")(literal({claim.field: claim.new_value}, JSONB)),
+            version=Entity.version + 1,
+            updated_at=now,
+        )
+        .returning(Entity)
+        .execution_options(populate_existing=True)
+    )
+    if _touches_key(entity.type, [claim.field]):
+        await sync_match_keys(db, user_id, [(entity.id, entity.type, entity.data)])
 
-    db.flush()
+    await notify_claims(db, user_id, "confirmed", [claim.id])
+    read_cache.invalidate_on_commit(db, user_id)
     return entity, None
+
+
+def _bulk_claim_filter(user_id, claim_ids, entity_id, field, client_id, limit: int):
+    stmt = select(Claim.id).where(Claim.user_id == user_id, _status_is("proposed"))
+    if claim_ids is not None:
+        stmt = stmt.where(Claim.id.in_(claim_ids))
+    if entity_id is not None:
+        stmt = stmt.where(Claim.entity_id == entity_id)
+    if field is not None:
+        stmt = stmt.where(Claim.field == field)
+    if client_id is not None:
+        stmt = stmt.where(Claim.client_id == client_id)
+    return stmt.order_by(Claim.created_at, Claim.id).limit(limit).scalar_subquery()
+
+
+async def confirm_claims(
+    db: AsyncSession,
+    user_id,
+    claim_ids=None,
+    entity_id=None,
+    field: str | None = None,
+    client_id: str | None = None,
+    limit: int = 1000,
+) -> list[Row]:
+    now = datetime.now(timezone.utc)
+    selected = _bulk_claim_filter(user_id, claim_ids, entity_id, field, client_id, limit)
+    candidates = (
+        await db.execute(
+            select(*CLAIM_OUT_COLUMNS)
+            .where(Claim.id.in_(selected), _status_is("proposed"))
+            .order_by(Claim.created_at, Claim.id)
+            .with_for_update()
+        )
+    ).all()
+    if not candidates:
+        return []
+    documents = dict(
+        (
+            await db.execute(
+                select(Entity.id, Entity.data)
+                .where(Entity.id.in_({claim.entity_id for claim in candidates}), Entity.user_id == user_id)
+                .order_by(Entity.id)
+                .with_for_update()
+            )
+        ).all()
+    )
+
+    # Claims whose field changed since they were proposed stay pending. Of the rest, only the
+    # newest claim per field is confirmed; older ones it supersedes are rejected.
+    fresh = [
+        claim
+        for claim in candidates
+        if claim.entity_id in documents and not _is_stale(documents[claim.entity_id], claim)
+    ]
+    if not fresh:
+        return []
+    newest = {(claim.entity_id, claim.field): claim for claim in fresh}
+    confirmed_ids = [claim.id for claim in newest.values()]
+    superseded = [claim.id for claim in fresh if newest[claim.entity_id, claim.field] is not claim]
+
+    resolved = {}
+    for ids, changes in (
+        (confirmed_ids, {"status": "confirmed", "confirmed_at": now}),
+        (superseded, {"status": "rejected"}),
+    ):
+        if ids:
+            result = await db.execute(
+                update(Claim).where(Claim.id.in_(ids)).values(**changes).returning(*CLAIM_OUT_COLUMNS)
+            )
+            resolved.update((claim.id, claim) for claim in result)
+    claims = [resolved[claim.id] for claim in fresh]
+
+    patches: dict[Any, dict[str, Any]] = {}
+    for (entity_id, field_name), claim in newest.items():
+        patches.setdefault(entity_id, {})[field_name] = claim.new_value
+
+    entities = Entity.__table__
+    await db.execute(
+        update(entities)
+        .where(entities.c.id == bindparam("b_id"), entities.c.user_id == user_id)
+        .values(
+            data=entities.c.data.op("||")(bindparam("b_patch", type_=JSONB)),
+            version=entities.c.version + 1,
+            updated_at=now,
+        ),
+        [{"b_id": entity_id, "b_patch": patch} for entity_id, patch in patches.items()],
+    )
+    rekey = [entity_id for entity_id, patch in patches.items() if not set(KEY_FIELD_NAMES).isdisjoint(patch)]
+    if rekey:
+        rows = await db.execute(
+            select(Entity.id, Entity.type, Entity.data).where(Entity.id.in_(rekey), Entity.user_id == user_id)
+        )
+        await sync_match_keys(db, user_id, [tuple(row) for row in rows if _touches_key(row.type, patches[row.id])])
+    await notify_claims(db, user_id, "confirmed", confirmed_ids)
+    await notify_claims(db, user_id, "rejected", superseded)
+    read_cache.invalidate_on_commit(db, user_id)
+    return claims
+
+
+async def reject_claims(
+    db: AsyncSession,
+    user_id,
+    claim_ids=None,
+    entity_id=None,
+    field: str | None = None,
+    client_id: str | None = None,
+    limit: int = 1000,
+) -> list[Row]:
+    selected = _bulk_claim_filter(user_id, claim_ids, entity_id, field, client_id, limit)
+    result = await db.execute(
+        update(Claim)
+        .where(Claim.id.in_(selected), _status_is("proposed"))
+        .values(status="rejected")
+        .returning(*CLAIM_OUT_COLUMNS)
+    )
+    claims = sorted(result, key=lambda c: (c.created_at, c.id))
+    await notify_claims(db, user_id, "rejected", [claim.id for claim in claims])
+    return claims
+
+
+EXPORT_CHUNK_ROWS = 1000
+
+EXPORT_COLUMNS = {
+    "entities": (Entity, [Entity.id, Entity.type, Entity.data, Entity.created_at, Entity.updated_at]),
+    "claims": (
+        Claim,
+        [
+            Claim.id,
+            Claim.client_id,
+            Claim.entity_id,
+            Claim.entity_type,
+            Claim.field,
+            Claim.old_value,
+            Claim.new_value,
+            Claim.status,
+            Claim.created_at,
+            Claim.confirmed_at,
+        ],
+    ),
+    # Resolved claims that compaction moved out of ``claims``.
+    "claim_history": (
+        ClaimHistory,
+        [
+            ClaimHistory.entity_id,
+            ClaimHistory.entries,
+            ClaimHistory.claims_count,
+            ClaimHistory.compacted_through,
+            ClaimHistory.updated_at,
+        ],
+    ),
+}
+
+
+async def export_rows(db: AsyncSession, user_id, kinds: Sequence[str]) -> AsyncIterator[tuple[str, Sequence[Row]]]:
+    """Yield ``(kind, rows)`` chunks read through a server-side cursor."""
+    for kind in kinds:
+        model, columns = EXPORT_COLUMNS[kind]
+        result = await db.stream(
+            select(*columns)
+            .where(model.user_id == user_id)
+            .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+        )
+        async for rows in result.partitions():
+            yield kind, rows
@@ -1,6 +1,8 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
+from app.metrics import InstrumentedPool, instrument_engine
 from app.settings import settings
 
 
@@ -8,13 +10,77 @@ class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(settings.database_url, future=True)
+def engine_options() -> dict:
+    options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+    if settings.db_statement_timeout_ms:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings.db_statement_timeout_ms}"}
+    return options
+
+
+# Blocking engine for scripts and tooling; the request path uses the async engines below.
+engine = create_engine(settings.database_url, future=True, **engine_options())
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+async_engine = create_async_engine(settings.database_url, poolclass=InstrumentedPool, **engine_options())
+instrument_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Read-only routes use the replica when one is configured, otherwise the primary.
+if settings.read_database_url:
+    async_read_engine = create_async_engine(settings.read_database_url, poolclass=InstrumentedPool, **engine_options())
+    instrument_engine(async_read_engine.sync_engine, "replica")
+else:
+    async_read_engine = async_engine
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
+
+# User data (entities, claims, ...) lives on shards; DATABASE_URL keeps grants and the shard
+# directory. Without SHARDS there is a single shard on DATABASE_URL (and READ_DATABASE_URL).
+DEFAULT_SHARD = "default"
+SHARD_URLS: dict[str, str] = settings.shards or {DEFAULT_SHARD: settings.database_url}
+
+
+def _shard_engine(url: str, label: str):
+    if url == settings.database_url:
+        return async_engine
+    shard_engine = create_async_engine(url, poolclass=InstrumentedPool, **engine_options())
+    instrument_engine(shard_engine.sync_engine, label)
+    return shard_engine
+
+
+shard_engines = {name: _shard_engine(url, f"shard:{name}") for name, url in SHARD_URLS.items()}
+shard_sessions = {
+    name: async_sessionmaker(bind=shard_engine, autoflush=False, expire_on_commit=False)
+    for name, shard_engine in shard_engines.items()
+}
+if settings.shards:
+    shard_read_sessions = {
+        name: async_sessionmaker(
+            bind=_shard_engine(settings.shard_read_urls[name], f"replica:{name}")
+            if name in settings.shard_read_urls
+            else shard_engines[name],
+            autoflush=False,
+            expire_on_commit=False,
+        )
+        for name in SHARD_URLS
+    }
+else:
+    shard_sessions[DEFAULT_SHARD] = AsyncSessionLocal
+    shard_read_sessions = {DEFAULT_SHARD: AsyncReadSessionLocal}
+
+# Read engines that are replicas: what they return may predate a write that just committed.
+replica_engines = {maker.kw["bind"] for maker in shard_read_sessions.values()} - {
+    async_engine,
+    *shard_engines.values(),
+}
+
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    """Session on DATABASE_URL (grants, shard directory); user data goes through app.sharding."""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
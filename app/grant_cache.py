@@ -0,0 +1,92 @@
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from app.models import Grant
+from app.settings import settings
+
+
+@dataclass(frozen=True)
+class CachedGrant:
+    id: uuid.UUID
+    user_id: uuid.UUID
+    client_id: str
+    scopes: frozenset[str]
+    expires_at: datetime
+
+    @classmethod
+    def from_model(cls, grant: Grant) -> "CachedGrant":
+        return cls(
+            id=grant.id,
+            user_id=grant.user_id,
+            client_id=grant.client_id,
+            scopes=frozenset(grant.scopes or ()),
+            expires_at=grant.expires_at,
+        )
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class GrantCache:
+    """Bounded LRU of verified grants keyed by token hash.
+
+    Entries live for ``ttl_seconds`` at most and never past the grant's own ``expires_at``.
+    Revocation in this process is immediate via ``invalidate*``; other processes see it once
+    their entry times out.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, CachedGrant]] = OrderedDict()
+
+    def get(self, token: str) -> CachedGrant | None:
+        key = _token_key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        deadline, grant = entry
+        if deadline <= time.monotonic() or grant.expires_at <= datetime.now(timezone.utc):
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return grant
+
+    def put(self, token: str, grant: CachedGrant) -> None:
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+
+        key = _token_key(token)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, grant)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        self._entries.pop(_token_key(token), None)
+
+    def invalidate_grant(self, grant_id: uuid.UUID) -> None:
+        for key, (_, grant) in list(self._entries.items()):
+            if grant.id == grant_id:
+                del self._entries[key]
+
+    def invalidate_user(self, user_id: uuid.UUID) -> None:
+        for key, (_, grant) in list(self._entries.items()):
+            if grant.user_id == user_id:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+grant_cache = GrantCache(
+    max_entries=settings.grant_cache_max_entries,
+    ttl_seconds=settings.grant_cache_ttl_seconds,
+)
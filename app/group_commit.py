@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+from app import crud, metrics
+from app.db import shard_sessions
+from app.schemas import WriteRequest
+from app.settings import settings
+from app.sharding import shard_router
+
+logger = logging.getLogger(__name__)
+
+STOP_DRAIN_TIMEOUT = 10.0
+
+
+@dataclass
+class _Pending:
+    shard: str
+    user_id: object
+    client_id: str
+    item: WriteRequest
+    enqueued: float
+    future: asyncio.Future = field(repr=False)
+
+
+class GroupCommitter:
+    """Applies concurrent ``/write`` calls of this process together, one transaction per flush.
+
+    Writes queue in arrival order; a single worker takes everything queued within ``window``
+    of the oldest write (up to ``max_items``) and applies it with ``crud.write_batch``, one
+    transaction per shard and one savepoint per (user, client). Flushes never overlap, so
+    writes to the same entity are applied in the order they arrived.
+    """
+
+    def __init__(self, window_seconds: float, max_items: int):
+        self.window_seconds = window_seconds
+        self.max_items = max_items
+        self._queue: asyncio.Queue[_Pending] | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, user_id, client_id: str, item: WriteRequest):
+        """Queue one write and wait for its ``(entity_id, applied, proposed)`` once committed."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        shard = (await shard_router.assignment(user_id)).shard
+        pending = _Pending(shard, user_id, client_id, item, loop.time(), loop.create_future())
+        self._queue.put_nowait(pending)
+        # A disconnecting client must not cancel the shared future; the write still lands.
+        return await asyncio.shield(pending.future)
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), STOP_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("group commit queue not drained on shutdown")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0].enqueued + self.window_seconds
+            while len(batch) < self.max_items:
+                # Writes that queued up during the previous flush have already waited long enough.
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_one(self, db, pending: _Pending):
+        try:
+            return (await crud.write_batch(db, pending.user_id, pending.client_id, [pending.item]))[0]
+        except Exception as exc:
+            return exc
+
+    async def _flush(self, batch: list[_Pending]) -> None:
+        metrics.GROUP_COMMIT_ITEMS.observe(len(batch))
+        shards: dict[str, dict[tuple, list[_Pending]]] = {}
+        for pending in batch:
+            shards.setdefault(pending.shard, {}).setdefault((pending.user_id, pending.client_id), []).append(pending)
+
+        outcomes: dict[int, object] = {}
+        for shard, groups in shards.items():
+            try:
+                async with shard_sessions[shard]() as db:
+                    for (user_id, client_id), members in groups.items():
+                        # write_batch works inside a savepoint, so one user's failure leaves the rest intact.
+                        try:
+                            results = await crud.write_batch(db, user_id, client_id, [p.item for p in members])
+                        except Exception as exc:
+                            # One bad write must not fail its neighbours: redo them one by one, in order.
+                            if len(members) == 1:
+                                results = [exc]
+                            else:
+                                results = [await self._write_one(db, pending) for pending in members]
+                        for pending, result in zip(members, results):
+                            outcomes[id(pending)] = result
+                    await db.commit()
+            except Exception as exc:
+                members = [pending for group in groups.values() for pending in group]
+                logger.exception("group commit of %d writes on shard %s failed", len(members), shard)
+                outcomes.update({id(pending): exc for pending in members})
+
+        for pending in batch:
+            if pending.future.done():
+                continue
+            result = outcomes[id(pending)]
+            if isinstance(result, BaseException):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+
+group_committer = GroupCommitter(
+    window_seconds=settings.write_group_commit_window_ms / 1000,
+    max_items=settings.write_group_commit_max_items,
+)
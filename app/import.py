@@ -0,0 +1,3 @@
+from app.importer import main
+
+main()
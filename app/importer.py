@@ -0,0 +1,446 @@
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import uuid
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import read_cache
+from app.crud import KEY_FIELD_NAMES, match_key, match_keys, notify_claims, sync_match_keys
+from app.schemas import ImportResult, WriteRequest
+
+STAGING_DDL = """
+CREATE TEMP TABLE import_rows (
+    seq bigint NOT NULL,
+    entity_type text NOT NULL,
+    match_key text,
+    match_keys text[] NOT NULL,
+    match jsonb NOT NULL,
+    rest jsonb NOT NULL,
+    patch jsonb NOT NULL,
+    entity_id uuid,
+    created boolean NOT NULL DEFAULT false
+) ON COMMIT DROP
+"""
+
+RESOLVE_BY_KEY = """
+UPDATE import_rows r SET entity_id = e.id
+FROM entity_keys k
+JOIN entities e ON e.id = k.entity_id
+WHERE r.entity_id IS NULL
+  AND r.match_key IS NOT NULL
+  AND k.user_id = :user_id
+  AND k.type = r.entity_type
+  AND k.key = r.match_key
+  AND e.data @> r.rest
+"""
+
+RESOLVE_BY_CONTAINMENT = """
+UPDATE import_rows r SET entity_id = (
+    SELECT e.id FROM entities e
+    WHERE e.user_id = :user_id AND e.type = r.entity_type AND e.data @> r.match
+    ORDER BY e.updated_at DESC
+    LIMIT 1
+)
+WHERE r.entity_id IS NULL
+"""
+
+# New entities start as their match document, so rows are re-attached by (type, match = data).
+# Keyed rows first take their key (the first spelling in the file wins it) and only the winners
+# become entities.
+CREATE_KEYED = """
+WITH wanted AS (
+    SELECT DISTINCT ON (entity_type, match) seq, entity_type, match, match_key, gen_random_uuid() AS id
+    FROM import_rows
+    WHERE entity_id IS NULL AND match_key IS NOT NULL
+    ORDER BY entity_type, match, seq
+), keyed AS (
+    INSERT INTO entity_keys (user_id, type, key, entity_id)
+    SELECT :user_id, entity_type, match_key, id
+    FROM wanted
+    ORDER BY seq
+    ON CONFLICT DO NOTHING
+    RETURNING entity_id
+), created AS (
+    INSERT INTO entities (id, user_id, type, data, version, created_at, updated_at)
+    SELECT w.id, :user_id, w.entity_type, w.match, 1, now(), now()
+    FROM wanted w
+    JOIN keyed k ON k.entity_id = w.id
+    RETURNING id, type, data
+), attached AS (
+    UPDATE import_rows r SET entity_id = c.id, created = true
+    FROM created c
+    WHERE r.entity_id IS NULL AND r.entity_type = c.type AND r.match = c.data
+)
+SELECT count(*) FROM created
+"""
+
+CREATE_UNKEYED = """
+WITH wanted AS (
+    SELECT DISTINCT ON (entity_type, match) seq, entity_type, match
+    FROM import_rows
+    WHERE entity_id IS NULL
+    ORDER BY entity_type, match, seq
+), created AS (
+    INSERT INTO entities (id, user_id, type, data, version, created_at, updated_at)
+    SELECT gen_random_uuid(), :user_id, entity_type, match, 1, now(), now()
+    FROM wanted
+    ORDER BY seq
+    RETURNING id, type, data
+), attached AS (
+    UPDATE import_rows r SET entity_id = c.id, created = true
+    FROM created c
+    WHERE r.entity_id IS NULL AND r.entity_type = c.type AND r.match = c.data
+)
+SELECT count(*) FROM created
+"""
+
+# The other identity keys of new entities, where no other entity holds them yet.
+KEY_CREATED = """
+INSERT INTO entity_keys (user_id, type, key, entity_id)
+SELECT DISTINCT :user_id, r.entity_type, k.key, r.entity_id
+FROM import_rows r
+CROSS JOIN unnest(r.match_keys) AS k(key)
+WHERE r.created
+ON CONFLICT DO NOTHING
+"""
+
+LOCK_ENTITIES = """
+SELECT e.id FROM entities e
+WHERE e.id IN (SELECT DISTINCT entity_id FROM import_rows)
+ORDER BY e.id
+FOR UPDATE
+"""
+
+# Mirrors crud._plan_patch applied row by row in seq order: while a field is empty each value
+# is applied; from the first non-empty value on, differing values become proposals against it.
+CLASSIFY = """
+CREATE TEMP TABLE import_fields ON COMMIT DROP AS
+WITH fields AS (
+    SELECT
+        r.seq,
+        r.entity_id,
+        e.type AS entity_type,
+        p.key AS field,
+        p.value AS new_value,
+        coalesce(e.data -> p.key, 'null'::jsonb) AS current_value,
+        coalesce(e.data ->> p.key, '') = '' AS was_empty,
+        p.value IN ('null'::jsonb, '""'::jsonb) AS value_empty
+    FROM import_rows r
+    JOIN entities e ON e.id = r.entity_id
+    CROSS JOIN LATERAL jsonb_each(r.patch) p
+), ordered AS (
+    SELECT
+        f.*,
+        lag(f.new_value) OVER w AS previous_value,
+        min(f.seq) FILTER (WHERE NOT f.value_empty) OVER (PARTITION BY f.entity_id, f.field) AS settled_seq
+    FROM fields f
+    WINDOW w AS (PARTITION BY f.entity_id, f.field ORDER BY f.seq)
+), settled AS (
+    SELECT o.*, s.new_value AS settled_value
+    FROM ordered o
+    LEFT JOIN ordered s ON s.entity_id = o.entity_id AND s.field = o.field AND s.seq = o.settled_seq
+)
+SELECT
+    seq,
+    entity_id,
+    entity_type,
+    field,
+    new_value,
+    CASE
+        WHEN NOT was_empty THEN current_value
+        WHEN settled_seq IS NULL OR seq <= settled_seq THEN coalesce(previous_value, current_value)
+        ELSE settled_value
+    END AS old_value,
+    CASE
+        WHEN was_empty AND (settled_seq IS NULL OR seq <= settled_seq) THEN 'applied'
+        WHEN was_empty AND new_value <> settled_value THEN 'proposed'
+        WHEN NOT was_empty AND new_value <> current_value THEN 'proposed'
+    END AS status
+FROM settled
+"""
+
+# A proposal identical to a pending claim, or to an earlier row of the file, is not stored again.
+INSERT_CLAIMS = """
+WITH candidates AS (
+    SELECT f.*, row_number() OVER (PARTITION BY f.entity_id, f.field, f.new_value, f.status ORDER BY f.seq) AS nth
+    FROM import_fields f
+    WHERE f.status IS NOT NULL
+), inserted AS (
+    INSERT INTO claims (id, user_id, client_id, entity_id, entity_type, field, old_value, new_value, status, created_at)
+    SELECT gen_random_uuid(), :user_id, :client_id, entity_id, entity_type, field, old_value, new_value, status, now()
+    FROM candidates c
+    WHERE c.status = 'applied'
+       OR (
+           c.nth = 1
+           AND NOT EXISTS (
+               SELECT 1 FROM claims p
+               WHERE p.entity_id = c.entity_id
+                 AND p.field = c.field
+                 AND p.status = 'proposed'
+                 AND p.new_value = c.new_value
+           )
+       )
+    ORDER BY seq
+    RETURNING status
+)
+SELECT status, count(*) FROM inserted GROUP BY status
+"""
+
+# Per entity, the fields this import applies.
+COLLECT_PATCHES = """
+CREATE TEMP TABLE import_patches ON COMMIT DROP AS
+SELECT
+    t.entity_id,
+    coalesce(
+        jsonb_object_agg(f.field, f.new_value ORDER BY f.seq) FILTER (WHERE f.status = 'applied'),
+        '{}'::jsonb
+    ) AS patch
+FROM (SELECT DISTINCT entity_id FROM import_rows) t
+LEFT JOIN import_fields f ON f.entity_id = t.entity_id
+GROUP BY t.entity_id
+"""
+
+APPLY_FIELDS = """
+UPDATE entities e
+SET data = e.data || p.patch,
+    version = e.version + 1,
+    updated_at = now()
+FROM import_patches p
+WHERE e.id = p.entity_id AND p.patch <> '{}'::jsonb
+"""
+
+# Entities whose identity fields this import filled in, for crud.sync_match_keys.
+KEYED_PATCHES = """
+SELECT e.id, e.type, e.data
+FROM import_patches p
+JOIN entities e ON e.id = p.entity_id
+WHERE p.patch ?| CAST(:key_fields AS text[])
+"""
+
+
+async def _copy_rows(db: AsyncSession, records: AsyncIterable[WriteRequest]) -> int:
+    connection = await db.connection()
+    raw = (await connection.get_raw_connection()).driver_connection
+    count = 0
+    async with raw.cursor() as cursor:
+        async with cursor.copy("COPY import_rows (seq, entity_type, match_key, match_keys, match, rest, patch) FROM STDIN") as copy:
+            async for record in records:
+                key, rest = match_key(record.entity_type, record.match)
+                await copy.write_row(
+                    (
+                        count,
+                        record.entity_type,
+                        key,
+                        match_keys(record.entity_type, record.match),
+                        json.dumps(record.match),
+                        json.dumps(rest),
+                        json.dumps(record.patch),
+                    )
+                )
+                count += 1
+    return count
+
+
+async def import_records(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    client_id: str,
+    records: AsyncIterable[WriteRequest],
+) -> ImportResult:
+    """Bulk-apply writes with the same empty-field / propose semantics as ``/write``.
+
+    Records are streamed into a temp table with ``COPY`` and merged set-wise; the caller commits.
+    """
+    params = {"user_id": user_id, "client_id": client_id}
+
+    await db.execute(text(STAGING_DDL))
+    rows = await _copy_rows(db, records)
+    if not rows:
+        return ImportResult(rows=0, entities_created=0, applied=0, proposed=0)
+
+    await db.execute(text("ANALYZE import_rows"))
+    await db.execute(text(RESOLVE_BY_KEY), params)
+    await db.execute(text(RESOLVE_BY_CONTAINMENT), params)
+    created = await db.scalar(text(CREATE_KEYED), params)
+    # Keys already taken (by a concurrent writer or another spelling in this file) resolve
+    # to the existing entity; anything still unmatched is created without that key.
+    await db.execute(text(RESOLVE_BY_KEY), params)
+    created += await db.scalar(text(CREATE_UNKEYED), params)
+    await db.execute(text(KEY_CREATED), params)
+
+    await db.execute(text(LOCK_ENTITIES))
+    await db.execute(text(CLASSIFY))
+    counts = dict((await db.execute(text(INSERT_CLAIMS), params)).all())
+    await db.execute(text(COLLECT_PATCHES))
+    await db.execute(text(APPLY_FIELDS))
+    keyed = await db.execute(text(KEYED_PATCHES), {"key_fields": KEY_FIELD_NAMES})
+    await sync_match_keys(db, user_id, keyed.all())
+    if counts.get("proposed"):
+        # Too many to enumerate in notifications; listeners reload their proposed list.
+        await notify_claims(db, user_id, "resync")
+    read_cache.invalidate_on_commit(db, user_id)
+
+    return ImportResult(
+        rows=rows,
+        entities_created=created,
+        applied=counts.get("applied", 0),
+        proposed=counts.get("proposed", 0),
+    )
+
+
+class ImportRowError(ValueError):
+    """A record failed validation; ``line`` is where it starts in the input (1-based)."""
+
+    def __init__(self, line: int, errors: list[dict]):
+        super().__init__(f"line {line}: {errors}")
+        self.line = line
+        self.errors = errors
+
+
+def parse_ndjson_line(line: str | bytes) -> WriteRequest | None:
+    if not line.strip():
+        return None
+    return WriteRequest.model_validate_json(line)
+
+
+def parse_csv_row(row: dict[str, str]) -> WriteRequest:
+    """CSV columns: ``entity_type`` plus ``match.<field>`` / ``patch.<field>``; blank cells are skipped."""
+    match: dict[str, str] = {}
+    patch: dict[str, str] = {}
+    for column, value in row.items():
+        if not column or value is None or value == "":
+            continue
+        if column.startswith("match."):
+            match[column[6:]] = value
+        elif column.startswith("patch."):
+            patch[column[6:]] = value
+    return WriteRequest(entity_type=row.get("entity_type"), match=match, patch=patch)
+
+
+class _RecordFeed:
+    """Iterator handing ``csv.reader`` one complete record at a time."""
+
+    def __init__(self) -> None:
+        self.record: str | None = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        record, self.record = self.record, None
+        if record is None:
+            raise StopIteration
+        return record
+
+
+async def csv_rows(lines: AsyncIterable[str]) -> AsyncIterator[tuple[int, list[str]]]:
+    """Parse CSV lines with one reader, yielding ``(first line number, values)`` per record.
+
+    Quoted fields may span lines: quotes inside a field are doubled, so a record is complete
+    once its quote count is even.
+    """
+    feed = _RecordFeed()
+    reader = csv.reader(feed)
+    pending: list[str] = []
+    quotes = 0
+    number = start = 0
+    async for line in lines:
+        number += 1
+        if not pending:
+            start = number
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        feed.record = "\n".join(pending)
+        pending, quotes = [], 0
+        values = next(reader, None)
+        if values:
+            yield start, values
+    if pending:
+        # An unterminated quote runs to the end of the input.
+        feed.record = "\n".join(pending)
+        values = next(reader, None)
+        if values:
+            yield start, values
+
+
+async def records_from_lines(lines: AsyncIterable[str], fmt: str) -> AsyncIterator[WriteRequest]:
+    if fmt == "csv":
+        header = None
+        async for number, values in csv_rows(lines):
+            if header is None:
+                header = values
+                continue
+            try:
+                yield parse_csv_row(dict(zip(header, values)))
+            except ValidationError as exc:
+                raise ImportRowError(number, exc.errors()) from None
+        return
+
+    number = 0
+    async for line in lines:
+        number += 1
+        try:
+            record = parse_ndjson_line(line)
+        except ValidationError as exc:
+            raise ImportRowError(number, exc.errors()) from None
+        if record is not None:
+            yield record
+
+
+async def lines_from_chunks(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for line in complete:
+            yield line.decode()
+    if buffer:
+        yield buffer.decode()
+
+
+async def _iterate(lines: Iterable[str]) -> AsyncIterator[str]:
+    for line in lines:
+        yield line
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.db import async_engine, shard_engines, shard_sessions
+    from app.sharding import shard_router
+
+    stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    try:
+        assignment = await shard_router.assignment(args.user_id)
+        if assignment.moving_to is not None:
+            raise SystemExit("user is being moved to another shard; retry once the move finishes")
+        async with shard_sessions[assignment.shard]() as db:
+            lines = _iterate(line.rstrip("\n") for line in stream)
+            try:
+                result = await import_records(db, args.user_id, args.client_id, records_from_lines(lines, fmt))
+            except ImportRowError as exc:
+                raise SystemExit(f"{args.path}: {exc}")
+            await db.commit()
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        for db_engine in {async_engine, *shard_engines.values()}:
+            await db_engine.dispose()
+
+    print(result.model_dump_json())
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.import", description="Bulk import entities for one user.")
+    parser.add_argument("path", help="NDJSON or CSV file, or - for stdin")
+    parser.add_argument("--user-id", type=uuid.UUID, required=True)
+    parser.add_argument("--client-id", default="bulk-import")
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    asyncio.run(_main(parser.parse_args(argv)))
@@ -1,36 +1,93 @@
+import hashlib
+import logging
 import secrets
 from datetime import datetime, timedelta, timezone
 from typing import Literal
 from uuid import UUID
 
-from fastapi import Depends, FastAPI, HTTPException, Request, status
-from sqlalchemy.orm import Session
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud
-from app.auth import require_grant
-from app.db import Base, engine, get_db
-from app.models import Grant
+from app import crud, importer, maintenance, metrics, search
+from app.auth import require_grant, require_scope
+from app.cache import read_cache
+from app.claim_feed import claim_feed
+from app.db import Base, async_engine, get_async_db, shard_engines
+from app.grant_cache import CachedGrant, grant_cache
+from app.group_commit import group_committer
+from app.models import DIRECTORY_TABLES, SHARD_TABLES, Grant
+from app.settings import settings
+from app.sharding import get_user_db, get_user_read_db
+from app.responses import RowJSONResponse, claim_item, entity_item
 from app.ui_routes import router as ui_router
 from app.schemas import (
-    ClaimOut,
+    ClaimBulkRequest,
+    ClaimBulkResponse,
+    ClaimPage,
     EntityOut,
     GrantCreateRequest,
     GrantCreateResponse,
+    ImportResult,
+    QueryBatchRequest,
+    QueryBatchResponse,
     QueryRequest,
+    WriteBatchRequest,
+    WriteBatchResponse,
     WriteRequest,
     WriteResponse,
 )
 
+logger = logging.getLogger(__name__)
+
+CLAIMS_PAGE_MAX = 500
+
 app = FastAPI(title="Ontology Vault")
+app.add_middleware(metrics.MetricsMiddleware, server_timing=settings.server_timing_enabled)
+
+
+@app.exception_handler(crud.ConcurrentUpdateError)
+async def concurrent_update_handler(request: Request, exc: crud.ConcurrentUpdateError):
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": "Entity was modified concurrently, retry the request"},
+    )
 
 
 @app.on_event("startup")
-def on_startup() -> None:
-    Base.metadata.create_all(bind=engine)
+async def on_startup() -> None:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=DIRECTORY_TABLES)
+    for shard_engine in shard_engines.values():
+        async with shard_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=SHARD_TABLES)
+        try:
+            async with shard_engine.begin() as conn:
+                await conn.run_sync(maintenance.ensure_claim_partitions)
+        except Exception:
+            # Claims still land in claims_default; `python -m app.maintenance partitions` can retry.
+            logger.exception("claims partition maintenance failed at startup")
+        if settings.search_indexes_auto:
+            async with shard_engine.connect() as conn:
+                await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.run_sync(search.ensure_search_indexes)
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await group_committer.stop()
+    await claim_feed.stop()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/dev/grants", response_model=GrantCreateResponse)
-def create_dev_grant(payload: GrantCreateRequest, db: Session = Depends(get_db)):
+async def create_dev_grant(payload: GrantCreateRequest, db: AsyncSession = Depends(get_async_db)):
     token = secrets.token_urlsafe(32)
     expires_at = datetime.now(timezone.utc) + timedelta(days=30)
 
@@ -42,80 +99,231 @@ def create_dev_grant(payload: GrantCreateRequest, db: Session = Depends(get_db))
         expires_at=expires_at,
     )
     db.add(grant)
-    db.commit()
+    await db.commit()
 
     return GrantCreateResponse(token=token, expires_at=expires_at)
 
 
+@app.post("/auth/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_token(
+    db: AsyncSession = Depends(get_async_db),
+    grant: CachedGrant = Depends(require_grant),
+):
+    await db.execute(delete(Grant).where(Grant.id == grant.id))
+    await db.commit()
+    grant_cache.invalidate_grant(grant.id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @app.post("/query", response_model=list[EntityOut])
-def query_entities(
+async def query_entities(
     payload: QueryRequest,
     request: Request,
-    db: Session = Depends(get_db),
-    _grant=Depends(require_grant),
+    db: AsyncSession = Depends(get_user_read_db),
+    _grant=Depends(require_scope("read")),
 ):
-    entities = crud.search_entities(
+    cache_key = read_cache.key(request.state.user_id, "query", payload.model_dump_json())
+    cached = read_cache.get(cache_key, "query")
+    if cached is not None:
+        return cached
+
+    entities = await crud.search_entities(
         db=db,
         user_id=request.state.user_id,
         q=payload.q,
         entity_type=payload.entity_type,
         max_results=payload.max_results,
+        mode=payload.mode,
+        fields=payload.fields,
     )
-    return [EntityOut(id=e.id, type=e.type, data=e.data) for e in entities]
+    response = RowJSONResponse([entity_item(e) for e in entities])
+    read_cache.set(cache_key, response, db)
+    return response
+
+
+@app.post("/query/batch", response_model=QueryBatchResponse)
+async def query_entities_batch(
+    payload: QueryBatchRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_user_read_db),
+    _grant=Depends(require_scope("read")),
+):
+    results = await crud.search_entities_batch(db=db, user_id=request.state.user_id, queries=payload.queries)
+    return RowJSONResponse({"results": [[entity_item(e) for e in rows] for rows in results]})
 
 
 @app.post("/write", response_model=WriteResponse)
-def write_entity(
+async def write_entity(
     payload: WriteRequest,
     request: Request,
-    db: Session = Depends(get_db),
-    _grant=Depends(require_grant),
+    db: AsyncSession = Depends(get_user_db),
+    _grant=Depends(require_scope("write")),
+    idempotency_key: str | None = Header(default=None, max_length=255),
 ):
-    entity = crud.find_or_create_entity(
-        db=db,
-        user_id=request.state.user_id,
-        entity_type=payload.entity_type,
-        match=payload.match,
-    )
-    applied, proposed = crud.write_with_claims(
+    # Keyed writes need their key reservation in the write's own transaction, so they go direct.
+    if settings.write_group_commit and idempotency_key is None:
+        with metrics.phase("group_commit"):
+            entity_id, applied, proposed = await group_committer.submit(
+                request.state.user_id, request.state.client_id, payload
+            )
+        return WriteResponse(entity_id=entity_id, applied=applied, proposed=proposed)
+
+    if idempotency_key is not None:
+        request_hash = hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+        stored, error = await crud.reserve_idempotency_key(db, request.state.user_id, idempotency_key, request_hash)
+        if error:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=error)
+        if stored is not None:
+            return JSONResponse(stored, headers={"Idempotent-Replayed": "true"})
+
+    with metrics.phase("match"):
+        entity = await crud.find_or_create_entity(
+            db=db,
+            user_id=request.state.user_id,
+            entity_type=payload.entity_type,
+            match=payload.match,
+        )
+    with metrics.phase("claims"):
+        applied, proposed = await crud.write_with_claims(
+            db=db,
+            user_id=request.state.user_id,
+            client_id=request.state.client_id,
+            entity=entity,
+            patch=payload.patch,
+        )
+    response = WriteResponse(entity_id=entity.id, applied=applied, proposed=proposed)
+    if idempotency_key is not None:
+        await crud.store_idempotent_response(db, request.state.user_id, idempotency_key, response.model_dump(mode="json"))
+    with metrics.phase("commit"):
+        await db.commit()
+    return response
+
+
+@app.post("/write/batch", response_model=WriteBatchResponse)
+async def write_entities_batch(
+    payload: WriteBatchRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_user_db),
+    _grant=Depends(require_scope("write")),
+):
+    results = await crud.write_batch(
         db=db,
         user_id=request.state.user_id,
         client_id=request.state.client_id,
-        entity=entity,
-        patch=payload.patch,
+        items=payload.items,
+    )
+    await db.commit()
+    return WriteBatchResponse(
+        results=[
+            WriteResponse(entity_id=entity_id, applied=applied, proposed=proposed)
+            for entity_id, applied, proposed in results
+        ]
     )
-    db.commit()
-    return WriteResponse(entity_id=entity.id, applied=applied, proposed=proposed)
 
 
-@app.get("/claims", response_model=list[ClaimOut])
-def get_claims(
+@app.post("/import", response_model=ImportResult)
+async def import_entities(
     request: Request,
-    status_filter: Literal["proposed", "applied", "confirmed"] = "proposed",
-    db: Session = Depends(get_db),
-    _grant=Depends(require_grant),
+    format: Literal["ndjson", "csv"] | None = None,
+    db: AsyncSession = Depends(get_user_db),
+    _grant=Depends(require_scope("write")),
 ):
-    claims = crud.list_claims(db=db, user_id=request.state.user_id, status=status_filter)
-    return [ClaimOut.model_validate(c) for c in claims]
+    if format is None:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    records = importer.records_from_lines(importer.lines_from_chunks(request.stream()), format)
+    try:
+        result = await importer.import_records(
+            db=db,
+            user_id=request.state.user_id,
+            client_id=request.state.client_id,
+            records=records,
+        )
+    except importer.ImportRowError as exc:
+        raise RequestValidationError([{**error, "loc": ("body", exc.line, *error["loc"])} for error in exc.errors])
+    await db.commit()
+    return result
+
+
+@app.get("/claims", response_model=ClaimPage)
+async def get_claims(
+    request: Request,
+    status_filter: Literal["proposed", "applied", "confirmed", "rejected"] = "proposed",
+    limit: int = 100,
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_user_read_db),
+    _grant=Depends(require_scope("read")),
+):
+    try:
+        claims, next_cursor = await crud.list_claims(
+            db=db,
+            user_id=request.state.user_id,
+            status=status_filter,
+            limit=min(max(limit, 1), CLAIMS_PAGE_MAX),
+            cursor=cursor,
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    # Pending claims change under the client constantly; never reuse a stored copy.
+    return RowJSONResponse(
+        {"items": [claim_item(c) for c in claims], "next_cursor": next_cursor},
+        headers={"Cache-Control": "private, no-store"},
+    )
+
+
+@app.get("/claims/stream")
+async def stream_claims(request: Request, _grant=Depends(require_scope("read"))):
+    return StreamingResponse(
+        claim_feed.events(request.state.user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/claims/{claim_id}/confirm", response_model=EntityOut)
-def confirm_claim(
+async def confirm_claim(
     claim_id: UUID,
     request: Request,
-    db: Session = Depends(get_db),
-    _grant=Depends(require_grant),
+    db: AsyncSession = Depends(get_user_db),
+    _grant=Depends(require_scope("write")),
 ):
-    entity, error = crud.confirm_claim(db=db, user_id=request.state.user_id, claim_id=claim_id)
+    entity, error = await crud.confirm_claim(db=db, user_id=request.state.user_id, claim_id=claim_id)
     if error == "not_found":
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Claim not found")
     if error == "invalid_status":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Claim is not in proposed state")
     if error == "entity_not_found":
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entity not found")
+    if error == "stale":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Entity field changed since the claim was proposed"
+        )
 
-    db.commit()
+    await db.commit()
     return EntityOut(id=entity.id, type=entity.type, data=entity.data)
 
 
+@app.post("/claims/confirm", response_model=ClaimBulkResponse)
+async def confirm_claims(
+    payload: ClaimBulkRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_user_db),
+    _grant=Depends(require_scope("write")),
+):
+    claims = await crud.confirm_claims(db=db, user_id=request.state.user_id, **payload.model_dump())
+    await db.commit()
+    return RowJSONResponse({"claims": [claim_item(c) for c in claims]})
+
+
+@app.post("/claims/reject", response_model=ClaimBulkResponse)
+async def reject_claims(
+    payload: ClaimBulkRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_user_db),
+    _grant=Depends(require_scope("write")),
+):
+    claims = await crud.reject_claims(db=db, user_id=request.state.user_id, **payload.model_dump())
+    await db.commit()
+    return RowJSONResponse({"claims": [claim_item(c) for c in claims]})
+
+
 app.include_router(ui_router)
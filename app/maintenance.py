@@ -0,0 +1,253 @@
+import argparse
+import json
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = "claims_p"
+
+CLAIM_PARTITIONS = """
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'claims'::regclass
+"""
+
+# Moves one time window of resolved claims into claim_history, appending to each entity's entries.
+COMPACT_WINDOW = """
+WITH moved AS (
+    DELETE FROM claims
+    WHERE status IN ('applied', 'confirmed', 'rejected')
+      AND created_at >= :window_start
+      AND created_at < :window_end
+    RETURNING *
+), grouped AS (
+    SELECT
+        entity_id,
+        user_id,
+        jsonb_agg(
+            jsonb_build_object(
+                'field', field,
+                'client_id', client_id,
+                'old_value', old_value,
+                'new_value', new_value,
+                'status', status,
+                'created_at', created_at,
+                'confirmed_at', confirmed_at
+            )
+            ORDER BY created_at, id
+        ) AS entries,
+        count(*) AS claims_count,
+        max(created_at) AS compacted_through
+    FROM moved
+    GROUP BY entity_id, user_id
+), upserted AS (
+    INSERT INTO claim_history (entity_id, user_id, entries, claims_count, compacted_through, updated_at)
+    SELECT entity_id, user_id, entries, claims_count, compacted_through, now()
+    FROM grouped
+    ON CONFLICT (entity_id) DO UPDATE SET
+        entries = claim_history.entries || excluded.entries,
+        claims_count = claim_history.claims_count + excluded.claims_count,
+        compacted_through = greatest(claim_history.compacted_through, excluded.compacted_through),
+        updated_at = excluded.updated_at
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM moved), (SELECT count(*) FROM upserted)
+"""
+
+
+# Claims for a month that had no partition yet landed in claims_default; they are parked here
+# while the month's partition is created, then re-inserted so they route into it.
+PARK_DEFAULT_ROWS = """
+WITH moved AS (
+    DELETE FROM claims_default WHERE created_at >= :start AND created_at < :end RETURNING *
+)
+INSERT INTO claims_parked SELECT * FROM moved
+"""
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def _is_partitioned(conn: Connection) -> bool:
+    kind = conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('claims')"))
+    return kind == "p"
+
+
+def ensure_claim_partitions(conn: Connection, months_ahead: int | None = None, today: date | None = None) -> list[str]:
+    """Create the default partition and monthly partitions from the current month onwards.
+
+    A month missed by earlier runs may already have rows in ``claims_default``; those are moved
+    into the new partition in the same transaction. A month that still cannot be created is
+    logged and skipped, so a lapse in maintenance never stops the app from starting.
+    """
+    if not _is_partitioned(conn):
+        logger.warning("claims is not a partitioned table; skipping partition maintenance")
+        return []
+
+    months_ahead = settings.claims_partition_months_ahead if months_ahead is None else months_ahead
+    month = _month_start(today or datetime.now(timezone.utc).date())
+
+    # Serializes concurrent workers running this at startup.
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('claims_partitions'))"))
+    existing = set(conn.scalars(text(CLAIM_PARTITIONS)))
+    created = []
+    if "claims_default" not in existing:
+        conn.execute(text("CREATE TABLE claims_default PARTITION OF claims DEFAULT"))
+        created.append("claims_default")
+    for offset in range(months_ahead + 1):
+        start = _add_months(month, offset)
+        name = _partition_name(start)
+        if name in existing:
+            continue
+        end = _add_months(start, 1)
+        bounds = {"start": f"{start.isoformat()} 00:00:00+00", "end": f"{end.isoformat()} 00:00:00+00"}
+        try:
+            with conn.begin_nested():
+                parked = conn.scalar(
+                    text("SELECT count(*) FROM claims_default WHERE created_at >= :start AND created_at < :end"),
+                    bounds,
+                )
+                if parked:
+                    conn.execute(text("CREATE TEMP TABLE claims_parked (LIKE claims)"))
+                    conn.execute(text(PARK_DEFAULT_ROWS), bounds)
+                conn.execute(
+                    text(
+                        f"CREATE TABLE {name} PARTITION OF claims "
+                        f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+                    )
+                )
+                if parked:
+                    conn.execute(text("INSERT INTO claims SELECT * FROM claims_parked"))
+                    conn.execute(text("DROP TABLE claims_parked"))
+                    logger.warning("moved %d claims from claims_default into new partition %s", parked, name)
+        except Exception:
+            logger.exception("could not create claims partition %s; skipping it", name)
+            continue
+        created.append(name)
+    return created
+
+
+def compact_claims(conn: Connection, retention_days: int | None = None, window_days: int = 7) -> dict[str, int]:
+    """Roll resolved claims older than the retention period into ``claim_history``.
+
+    Windows are processed oldest first and committed one by one, so each entity's history
+    stays in creation order and a long backlog never runs as a single transaction.
+    """
+    retention_days = settings.claims_retention_days if retention_days is None else retention_days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    oldest = conn.scalar(
+        text("SELECT min(created_at) FROM claims WHERE status IN ('applied', 'confirmed', 'rejected') AND created_at < :cutoff"),
+        {"cutoff": cutoff},
+    )
+    conn.commit()
+
+    moved = entities = 0
+    window_start = oldest
+    while window_start is not None and window_start < cutoff:
+        window_end = min(window_start + timedelta(days=window_days), cutoff)
+        claims, histories = conn.execute(
+            text(COMPACT_WINDOW), {"window_start": window_start, "window_end": window_end}
+        ).one()
+        conn.commit()
+        moved += claims
+        entities += histories
+        window_start = window_end
+    return {"claims_compacted": moved, "history_rows_touched": entities}
+
+
+def drop_empty_partitions(conn: Connection, retention_days: int | None = None) -> list[str]:
+    """Drop monthly partitions entirely older than the retention cutoff that hold no claims."""
+    if not _is_partitioned(conn):
+        return []
+
+    retention_days = settings.claims_retention_days if retention_days is None else retention_days
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).date()
+    dropped = []
+    for name in sorted(conn.scalars(text(CLAIM_PARTITIONS))):
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        month = datetime.strptime(name[len(PARTITION_PREFIX) :], "%Y%m").date()
+        if _add_months(month, 1) > cutoff:
+            continue
+        if conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {name})")):
+            continue
+        conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    conn.commit()
+    return dropped
+
+
+def purge_idempotency_keys(conn: Connection, ttl_seconds: int | None = None) -> int:
+    """Delete stored ``/write`` responses older than the idempotency TTL."""
+    ttl_seconds = settings.idempotency_ttl_seconds if ttl_seconds is None else ttl_seconds
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    deleted = conn.execute(text("DELETE FROM idempotency_keys WHERE created_at < :cutoff"), {"cutoff": cutoff}).rowcount
+    conn.commit()
+    return deleted
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance", description="Storage maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    partitions = commands.add_parser("partitions", help="create upcoming monthly claims partitions")
+    partitions.add_argument("--months-ahead", type=int)
+
+    compact = commands.add_parser("compact", help="move old resolved claims into claim_history")
+    compact.add_argument("--retention-days", type=int)
+    compact.add_argument("--window-days", type=int, default=7)
+    compact.add_argument("--drop-empty", action="store_true", help="also drop emptied old partitions")
+
+    commands.add_parser("search-indexes", help="build or drop per-type search indexes to match SEARCH_FIELDS")
+
+    idempotency = commands.add_parser("idempotency-keys", help="delete expired Idempotency-Key responses")
+    idempotency.add_argument("--ttl-seconds", type=int)
+
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine
+
+    from app.db import SHARD_URLS, engine, engine_options
+    from app.search import ensure_search_indexes
+
+    # Every command works on user data, so it runs once per shard.
+    results = {}
+    for shard, url in SHARD_URLS.items():
+        shard_engine = engine if url == settings.database_url else create_engine(url, **engine_options())
+        with shard_engine.connect() as conn:
+            if args.command == "search-indexes":
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                result = ensure_search_indexes(conn)
+            elif args.command == "idempotency-keys":
+                result = {"deleted": purge_idempotency_keys(conn, args.ttl_seconds)}
+            elif args.command == "partitions":
+                result = {"created": ensure_claim_partitions(conn, args.months_ahead)}
+                conn.commit()
+            else:
+                result = compact_claims(conn, args.retention_days, args.window_days)
+                if args.drop_empty:
+                    result["dropped_partitions"] = drop_empty_partitions(conn, args.retention_days)
+        shard_engine.dispose()
+        results[shard] = result
+    print(json.dumps(results if settings.shards else results.popitem()[1]))
+
+
+if __name__ == "__main__":
+    main()
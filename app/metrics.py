@@ -0,0 +1,280 @@
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+_INF = 'le="+Inf"'
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.label_names, self.buckets = name, help, labels, buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {_number(cumulative)}")
+                cumulative += series[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, _INF)} {_number(cumulative)}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-1])}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {_number(cumulative)}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request.", ("method", "route"), COUNT_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL per request.", ("method", "route"))
+PHASE_SECONDS = Histogram("app_phase_duration_seconds", "Time spent in named request phases.", ("route", "phase"))
+READ_CACHE_REQUESTS = Counter("read_cache_requests_total", "Read cache lookups by kind and result.", ("kind", "result"))
+ADMISSION_REQUESTS = Counter(
+    "admission_requests_total", "Admission decisions per route (admitted, queued, rejected).", ("route", "result")
+)
+ADMISSION_WAIT_SECONDS = Histogram("admission_wait_seconds", "Time requests waited for admission.", ("route",))
+GROUP_COMMIT_ITEMS = Histogram("write_group_commit_items", "Writes applied per group commit.", (), COUNT_BUCKETS)
+POOL_WAIT_SECONDS = Histogram("db_pool_checkout_wait_seconds", "Time to check a connection out of the pool.", ("engine",))
+
+_engines: dict[str, Engine] = {}
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    # Wall time of each named phase, and the SQL time spent inside it.
+    phases: dict[str, float] = field(default_factory=dict)
+    phase_db: dict[str, float] = field(default_factory=dict)
+    phase: str | None = None
+
+
+_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block of a request; SQL executed inside it is attributed to ``name``."""
+    stats = _stats.get()
+    if stats is None:
+        yield
+        return
+    outer, stats.phase = stats.phase, name
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.phase = outer
+        stats.phases[name] = stats.phases.get(name, 0.0) + elapsed
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited (including new connects)."""
+
+    engine_label = "primary"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            elapsed = time.perf_counter() - started
+            POOL_WAIT_SECONDS.observe(elapsed, self.engine_label)
+            stats = _stats.get()
+            if stats is not None:
+                stats.pool_wait_seconds += elapsed
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.engine_label = self.engine_label
+        return pool
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(conn)
+
+
+def _handle_error(exception_context) -> None:
+    # A failing statement never reaches after_cursor_execute; close its timing here.
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        _record_query(conn)
+
+
+def _record_query(conn) -> None:
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _stats.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if stats.phase is not None:
+        stats.phase_db[stats.phase] = stats.phase_db.get(stats.phase, 0.0) + elapsed
+
+
+def instrument_engine(engine: Engine, label: str = "primary") -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    if isinstance(engine.pool, InstrumentedPool):
+        engine.pool.engine_label = label
+        _engines[label] = engine
+
+
+def _pool_lines() -> list[str]:
+    gauges = {
+        "db_pool_size": ("Configured pool size.", lambda p: p.size()),
+        "db_pool_checked_out": ("Connections currently checked out.", lambda p: p.checkedout()),
+        "db_pool_overflow": ("Overflow connections currently open.", lambda p: max(p.overflow(), 0)),
+        "db_pool_saturation": (
+            "Checked-out connections as a fraction of size plus max overflow.",
+            lambda p: p.checkedout() / max(p.size() + max(p._max_overflow, 0), 1),
+        ),
+    }
+    lines = []
+    for name, (help, read) in gauges.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        for label, engine in sorted(_engines.items()):
+            lines.append(f'{name}{{engine="{label}"}} {_number(read(engine.pool))}')
+    return lines
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in (
+        REQUESTS,
+        REQUEST_SECONDS,
+        REQUEST_DB_QUERIES,
+        REQUEST_DB_SECONDS,
+        PHASE_SECONDS,
+        POOL_WAIT_SECONDS,
+        READ_CACHE_REQUESTS,
+        ADMISSION_REQUESTS,
+        ADMISSION_WAIT_SECONDS,
+        GROUP_COMMIT_ITEMS,
+    ):
+        lines += metric.render()
+    lines += _pool_lines()
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(stats: RequestStats, total: float) -> str:
+    entries = [
+        f'{name};dur={seconds * 1000:.1f};desc="sql {stats.phase_db.get(name, 0.0) * 1000:.1f}ms"'
+        for name, seconds in stats.phases.items()
+    ]
+    entries.append(f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"')
+    if stats.pool_wait_seconds:
+        entries.append(f"pool;dur={stats.pool_wait_seconds * 1000:.1f}")
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """ASGI middleware collecting per-request SQL stats and route latency."""
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    header = server_timing(stats, time.perf_counter() - started).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners can't blow up cardinality.
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            REQUESTS.inc(method, route_path, str(status_code))
+            REQUEST_SECONDS.observe(elapsed, method, route_path)
+            REQUEST_DB_QUERIES.observe(stats.queries, method, route_path)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, method, route_path)
+            for name, seconds in stats.phases.items():
+                PHASE_SECONDS.observe(seconds, route_path, name)
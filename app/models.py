@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import DateTime, ForeignKey, Index, String, Text
+from sqlalchemy import DDL, DateTime, ForeignKey, Index, Integer, String, Text, event
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -19,15 +19,32 @@ class Entity(Base):
     user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), index=True, nullable=False)
     type: Mapped[str] = mapped_column(Text, index=True, nullable=False)
     data: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
 
 
+class EntityKey(Base):
+    """Normalized identity value of an entity (``email:…``, ``name:…``), one row per identity field.
+
+    The primary key makes each key resolve to at most one entity; see ``crud.match_keys``.
+    """
+
+    __tablename__ = "entity_keys"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    type: Mapped[str] = mapped_column(Text, primary_key=True)
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    entity_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("entities.id"), index=True, nullable=False)
+
+
 class Claim(Base):
     __tablename__ = "claims"
+    # Range-partitioned by month (see app.maintenance); the partition key must be in the primary key.
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), index=True, nullable=False)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
     client_id: Mapped[str] = mapped_column(Text, nullable=False)
     entity_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("entities.id"), nullable=False)
     entity_type: Mapped[str] = mapped_column(Text, nullable=False)
@@ -35,10 +52,24 @@ class Claim(Base):
     old_value: Mapped[dict | list | str | int | float | bool | None] = mapped_column(JSONB, nullable=True)
     new_value: Mapped[dict | list | str | int | float | bool | None] = mapped_column(JSONB, nullable=False)
     status: Mapped[str] = mapped_column(String(20), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True, default=utcnow)
     confirmed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
 
+class ClaimHistory(Base):
+    """Resolved claims compacted out of ``claims``, one row per entity."""
+
+    __tablename__ = "claim_history"
+
+    entity_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("entities.id"), primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), index=True, nullable=False)
+    # [{"field", "client_id", "old_value", "new_value", "status", "created_at", "confirmed_at"}, ...] oldest first
+    entries: Mapped[list] = mapped_column(JSONB, nullable=False, default=list)
+    claims_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    compacted_through: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+
 class Grant(Base):
     __tablename__ = "grants"
 
@@ -50,4 +81,48 @@ class Grant(Base):
     expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
 
 
-Index("ix_claims_user_created", Claim.user_id, Claim.created_at.desc())
+class IdempotencyKey(Base):
+    """Response of a ``/write`` sent with an ``Idempotency-Key``, replayed to retries until it expires."""
+
+    __tablename__ = "idempotency_keys"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    request_hash: Mapped[str] = mapped_column(Text, nullable=False)
+    response: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, index=True, nullable=False)
+
+
+class UserShard(Base):
+    """Directory entry pinning a user to a shard instead of the hash ring's choice (see app.sharding)."""
+
+    __tablename__ = "user_shards"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    shard: Mapped[str] = mapped_column(Text, nullable=False)
+    # Set while the user's rows are being copied to that shard; writes are refused meanwhile.
+    moving_to: Mapped[str | None] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+
+Index("ix_claims_user_status_created", Claim.user_id, Claim.status, Claim.created_at.desc(), Claim.id.desc())
+# Pending claims are a small, hot subset; these stay tiny however many applied claims accumulate.
+Index(
+    "ix_claims_proposed_user_created",
+    Claim.user_id,
+    Claim.created_at.desc(),
+    Claim.id.desc(),
+    postgresql_where=Claim.status == "proposed",
+)
+# Also the lookup behind proposed-claim dedup (a unique index is impossible: it would need created_at).
+Index("ix_claims_proposed_entity_field", Claim.entity_id, Claim.field, postgresql_where=Claim.status == "proposed")
+Index("ix_entities_user_updated", Entity.user_id, Entity.updated_at.desc(), Entity.id.desc())
+Index("ix_entities_data_path_ops", Entity.data, postgresql_using="gin", postgresql_ops={"data": "jsonb_path_ops"})
+# Per-type trigram search indexes are managed by app.search from SEARCH_FIELDS.
+
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+# DATABASE_URL holds the directory tables; every shard holds the user-data tables.
+DIRECTORY_TABLES = [Grant.__table__, UserShard.__table__]
+# Parents before children, which is also the order to copy a user's rows in.
+SHARD_TABLES = [Entity.__table__, EntityKey.__table__, Claim.__table__, ClaimHistory.__table__, IdempotencyKey.__table__]
@@ -0,0 +1,19 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+
+def encode_cursor(position: datetime, row_id: uuid.UUID) -> str:
+    raw = json.dumps([position.isoformat(), str(row_id)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """Inverse of ``encode_cursor``; raises ``ValueError`` for anything it did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position, row_id = json.loads(raw)
+        return datetime.fromisoformat(position), uuid.UUID(row_id)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
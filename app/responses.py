@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any
+
+from fastapi import Request, status
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+from app.crud import CLAIM_OUT_COLUMNS
+
+_rows = TypeAdapter(Any)
+_claim_keys = tuple(column.key for column in CLAIM_OUT_COLUMNS)
+
+
+class RowJSONResponse(Response):
+    """JSON response for plain dicts built from selected columns.
+
+    pydantic-core encodes UUIDs, datetimes and JSONB values in one pass, and returning a
+    ``Response`` makes FastAPI skip re-validating the content against ``response_model``.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+def dump_json(content: Any) -> bytes:
+    return _rows.dump_json(content)
+
+
+def entity_item(row) -> dict[str, Any]:
+    return {"id": row.id, "type": row.type, "data": row.data}
+
+
+def claim_item(row) -> dict[str, Any]:
+    # Row._asdict() is several times slower than zipping against the known column order.
+    return dict(zip(_claim_keys, row))
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison (RFC 9110 8.8.3.2): W/ prefixes are ignored.
+    if if_none_match.strip() == "*":
+        return True
+    target = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == target for tag in if_none_match.split(","))
+
+
+def not_modified(request: Request, headers: dict[str, str]) -> Response | None:
+    """A ``304`` carrying ``headers`` if the request's validators match them, else ``None``.
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``, as the RFC requires.
+    """
+    etag = headers.get("ETag")
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        matched = etag is not None and _etag_matches(if_none_match, etag)
+    else:
+        since = request.headers.get("if-modified-since")
+        last_modified = headers.get("Last-Modified")
+        if not since or not last_modified:
+            return None
+        try:
+            matched = parsedate_to_datetime(last_modified) <= parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return None
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers) if matched else None
@@ -2,13 +2,22 @@ import uuid
 from datetime import datetime
 from typing import Any, Literal
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
+
+MAX_PROJECTED_FIELDS = 50
 
 
 class QueryRequest(BaseModel):
     q: str
     entity_type: str | None = None
     max_results: int = 5
+    mode: Literal["substring", "prefix", "fuzzy"] = "substring"
+    # Return only these keys of ``data``.
+    fields: list[str] | None = Field(default=None, max_length=MAX_PROJECTED_FIELDS)
+
+
+class QueryBatchRequest(BaseModel):
+    queries: list[QueryRequest] = Field(min_length=1, max_length=50)
 
 
 class EntityOut(BaseModel):
@@ -17,6 +26,16 @@ class EntityOut(BaseModel):
     data: dict[str, Any]
 
 
+class EntityPage(BaseModel):
+    items: list[EntityOut]
+    next_cursor: str | None = None
+
+
+class QueryBatchResponse(BaseModel):
+    # One result list per query, in request order.
+    results: list[list[EntityOut]]
+
+
 class WriteRequest(BaseModel):
     entity_type: Literal["contact", "preference", "goal"]
     match: dict[str, Any] = Field(default_factory=dict)
@@ -37,10 +56,25 @@ class WriteResponse(BaseModel):
     proposed: list[ProposedField]
 
 
+class WriteBatchRequest(BaseModel):
+    items: list[WriteRequest] = Field(min_length=1, max_length=1000)
+
+
+class WriteBatchResponse(BaseModel):
+    results: list[WriteResponse]
+
+
+class ImportResult(BaseModel):
+    rows: int
+    entities_created: int
+    applied: int
+    proposed: int
+
+
 class GrantCreateRequest(BaseModel):
     user_id: uuid.UUID
     client_id: str
-    scopes: list[str] = Field(default_factory=list)
+    scopes: list[str] = Field(default_factory=lambda: ["read", "write"])
 
 
 class GrantCreateResponse(BaseModel):
@@ -62,3 +96,26 @@ class ClaimOut(BaseModel):
     confirmed_at: datetime | None
 
     model_config = {"from_attributes": True}
+
+
+class ClaimPage(BaseModel):
+    items: list[ClaimOut]
+    next_cursor: str | None = None
+
+
+class ClaimBulkRequest(BaseModel):
+    claim_ids: list[uuid.UUID] | None = Field(default=None, max_length=5000)
+    entity_id: uuid.UUID | None = None
+    field: str | None = None
+    client_id: str | None = None
+    limit: int = Field(default=1000, ge=1, le=5000)
+
+    @model_validator(mode="after")
+    def require_selector(self):
+        if self.claim_ids is None and self.entity_id is None and self.field is None and self.client_id is None:
+            raise ValueError("Provide claim_ids or at least one of entity_id, field, client_id")
+        return self
+
+
+class ClaimBulkResponse(BaseModel):
+    claims: list[ClaimOut]
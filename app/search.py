@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import re
+from collections.abc import Callable
+
+from sqlalchemy import Text, and_, false, func, literal_column, or_, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.models import Entity
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Indexes with this prefix are owned by ensure_search_indexes and dropped when unconfigured.
+INDEX_PREFIX = "ix_entities_search_"
+
+SEARCH_INDEXES = f"""
+SELECT c.relname, i.indisvalid
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = 'entities'::regclass AND c.relname LIKE '{INDEX_PREFIX}%'
+"""
+
+
+def sql_literal(value: str):
+    """Inline a string as a SQL literal so predicates match index expressions and partial-index
+    conditions even under prepared generic plans."""
+    return literal_column("'" + value.replace("'", "''") + "'", Text)
+
+
+def json_text(field: str):
+    return Entity.data[sql_literal(field)].astext
+
+
+def search_schema() -> dict[str, tuple[str, ...]]:
+    return {entity_type: tuple(dict.fromkeys(fields)) for entity_type, fields in settings.search_fields.items() if fields}
+
+
+def searchable(entity_type: str | None) -> bool:
+    schema = search_schema()
+    return entity_type in schema if entity_type else bool(schema)
+
+
+def match_clause(entity_type: str | None, matcher: Callable[[ColumnElement], ColumnElement]) -> ColumnElement:
+    """``matcher`` applied to each searchable field, per type, OR-ed together.
+
+    Each branch is guarded by ``type = '<type>'`` so the planner can use that type's partial
+    indexes; types without searchable fields never match (callers check ``searchable`` first).
+    """
+    schema = search_schema()
+    types = [entity_type] if entity_type else list(schema)
+    branches = [
+        and_(Entity.type == sql_literal(t), or_(*[matcher(json_text(field)) for field in schema[t]]))
+        for t in types
+        if t in schema
+    ]
+    return or_(*branches) if branches else false()
+
+
+def rank_fields(entity_type: str | None) -> list[ColumnElement]:
+    schema = search_schema()
+    fields = schema.get(entity_type, ()) if entity_type else [f for fields in schema.values() for f in fields]
+    return [json_text(field) for field in dict.fromkeys(fields)]
+
+
+def similarity_rank(entity_type: str | None, q: str) -> ColumnElement:
+    return func.greatest(*[func.similarity(column, q) for column in rank_fields(entity_type)])
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_")
+
+
+def index_name(entity_type: str, field: str) -> str:
+    name = f"{INDEX_PREFIX}{_slug(entity_type)}_{_slug(field)}"
+    if len(name) > 63:
+        digest = hashlib.sha1(f"{entity_type}\0{field}".encode()).hexdigest()[:10]
+        name = f"{name[:52]}_{digest}"
+    return name
+
+
+def index_definitions() -> dict[str, str]:
+    definitions = {}
+    for entity_type, fields in search_schema().items():
+        for field in fields:
+            key = field.replace("'", "''")
+            type_literal = entity_type.replace("'", "''")
+            definitions[index_name(entity_type, field)] = (
+                f"ON entities USING gin ((data ->> '{key}') gin_trgm_ops) WHERE type = '{type_literal}'"
+            )
+    return definitions
+
+
+def ensure_search_indexes(conn: Connection) -> dict[str, list[str]]:
+    """Create the configured per-type trigram indexes and drop ones no longer configured.
+
+    Needs an AUTOCOMMIT connection: indexes are built ``CONCURRENTLY`` so writes keep flowing.
+    """
+    wanted = index_definitions()
+    conn.execute(text("SELECT pg_advisory_lock(hashtext('entities_search_indexes'))"))
+    try:
+        existing = dict(conn.execute(text(SEARCH_INDEXES)).all())
+        dropped = []
+        for name, valid in existing.items():
+            # Invalid indexes are left behind by interrupted concurrent builds.
+            if name not in wanted or not valid:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+                if name not in wanted:
+                    dropped.append(name)
+        created = []
+        for name, definition in wanted.items():
+            if existing.get(name):
+                continue
+            logger.info("building search index %s", name)
+            conn.execute(text(f'CREATE INDEX CONCURRENTLY "{name}" {definition}'))
+            created.append(name)
+    finally:
+        conn.execute(text("SELECT pg_advisory_unlock(hashtext('entities_search_indexes'))"))
+    return {"created": created, "dropped": dropped}
@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import time
+import uuid
+from bisect import bisect
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.admission import admit
+from app.db import SHARD_URLS, AsyncSessionLocal, shard_read_sessions, shard_sessions
+from app.grant_cache import CachedGrant
+from app.maintenance import ensure_claim_partitions
+from app.models import SHARD_TABLES, Entity, UserShard
+from app.settings import settings
+
+MOVE_RETRY_AFTER_SECONDS = 5
+COPY_CHUNK_ROWS = 1000
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing over shard names: adding a shard only moves about 1/N of the users."""
+
+    def __init__(self, shards: Iterable[str], vnodes: int):
+        points = sorted((_point(f"{shard}#{i}"), shard) for shard in shards for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id) -> str:
+        index = bisect(self._points, _point(str(user_id))) % len(self._points)
+        return self._shards[index]
+
+
+class ShardAssignment(NamedTuple):
+    shard: str
+    moving_to: str | None = None
+
+
+class ShardRouter:
+    """Maps users to shards: the ``user_shards`` directory if pinned there, else the hash ring.
+
+    Directory lookups are cached for ``ttl_seconds``; ``move_user`` waits out that TTL between
+    steps so no process can act on an outdated assignment.
+    """
+
+    def __init__(self, shards: Iterable[str], vnodes: int, ttl_seconds: float, max_entries: int = 100_000):
+        self.shards = list(shards)
+        self.ring = HashRing(self.shards, vnodes)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache: OrderedDict[uuid.UUID, tuple[float, ShardAssignment]] = OrderedDict()
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.shards) > 1
+
+    async def assignment(self, user_id: uuid.UUID) -> ShardAssignment:
+        if not self.sharded:
+            return ShardAssignment(self.shards[0])
+
+        entry = self._cache.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(user_id)
+            return entry[1]
+
+        async with AsyncSessionLocal() as db:
+            row = (
+                await db.execute(select(UserShard.shard, UserShard.moving_to).where(UserShard.user_id == user_id))
+            ).first()
+        assignment = ShardAssignment(*row) if row else ShardAssignment(self.ring.shard_for(user_id))
+        self._cache[user_id] = (time.monotonic() + self.ttl_seconds, assignment)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return assignment
+
+    @asynccontextmanager
+    async def read_session(self, user_id: uuid.UUID) -> AsyncIterator[AsyncSession]:
+        """A read session on the user's shard, for code outside the request dependencies."""
+        async with shard_read_sessions[(await self.assignment(user_id)).shard]() as db:
+            yield db
+
+
+shard_router = ShardRouter(SHARD_URLS, settings.shard_ring_vnodes, settings.shard_lookup_ttl_seconds)
+
+
+async def get_user_db(grant: CachedGrant = Depends(admit)):
+    """Session on the authenticated user's shard; refuses while the user is being moved.
+
+    Depends on ``admit``, so an over-limit client is turned away before any session exists.
+    """
+    assignment = await shard_router.assignment(grant.user_id)
+    if assignment.moving_to is not None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="User data is being moved to another shard, retry shortly",
+            headers={"Retry-After": str(MOVE_RETRY_AFTER_SECONDS)},
+        )
+    async with shard_sessions[assignment.shard]() as db:
+        yield db
+
+
+async def get_user_read_db(grant: CachedGrant = Depends(admit)):
+    # Reads keep going to the source shard during a move; its rows are unchanged until the switch.
+    assignment = await shard_router.assignment(grant.user_id)
+    async with shard_read_sessions[assignment.shard]() as db:
+        yield db
+
+
+def _directory_assignment(conn: Connection, user_id: uuid.UUID) -> ShardAssignment:
+    row = conn.execute(select(UserShard.shard, UserShard.moving_to).where(UserShard.user_id == user_id)).first()
+    return ShardAssignment(*row) if row else ShardAssignment(shard_router.ring.shard_for(user_id))
+
+
+def _set_assignment(conn: Connection, user_id: uuid.UUID, shard: str, moving_to: str | None) -> None:
+    stmt = pg_insert(UserShard).values(user_id=user_id, shard=shard, moving_to=moving_to)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[UserShard.user_id],
+            set_={"shard": shard, "moving_to": moving_to, "updated_at": func.now()},
+        )
+    )
+    conn.commit()
+
+
+def _pin(conn: Connection, user_id: uuid.UUID, shard: str) -> None:
+    """Point the directory at ``shard``, dropping the entry when the ring already agrees."""
+    if shard == shard_router.ring.shard_for(user_id):
+        conn.execute(delete(UserShard).where(UserShard.user_id == user_id))
+        conn.commit()
+    else:
+        _set_assignment(conn, user_id, shard, None)
+
+
+def _delete_user_rows(conn: Connection, user_id: uuid.UUID) -> dict[str, int]:
+    return {
+        table.name: conn.execute(delete(table).where(table.c.user_id == user_id)).rowcount
+        for table in reversed(SHARD_TABLES)
+    }
+
+
+def _copy_user_rows(source: Connection, target: Connection, user_id: uuid.UUID) -> dict[str, int]:
+    copied = {}
+    for table in SHARD_TABLES:
+        result = source.execute(
+            select(table)
+            .where(table.c.user_id == user_id)
+            .execution_options(stream_results=True, yield_per=COPY_CHUNK_ROWS)
+        )
+        copied[table.name] = 0
+        for chunk in result.mappings().partitions():
+            target.execute(insert(table), [dict(row) for row in chunk])
+            copied[table.name] += len(chunk)
+    return copied
+
+
+def move_user(directory: Connection, shards: dict[str, Connection], user_id: uuid.UUID, target: str) -> dict:
+    """Move one user's rows to ``target`` and repoint the directory.
+
+    1. Mark the user as moving and wait one lookup TTL: every process now refuses their writes.
+    2. Copy the rows to the target in one transaction (replacing leftovers of a failed attempt).
+    3. Switch the directory to the target and wait another TTL so no process still reads the source.
+    4. Delete the rows from the source.
+    """
+    if target not in shards:
+        raise ValueError(f"unknown shard {target!r}")
+    current = _directory_assignment(directory, user_id)
+    source = current.shard
+    if source == target:
+        if current.moving_to is not None:
+            # Cancels an interrupted move; the rows never left the source.
+            _pin(directory, user_id, source)
+        return {"user_id": str(user_id), "shard": source, "moved": False}
+
+    wait = settings.shard_lookup_ttl_seconds + 1
+    _set_assignment(directory, user_id, source, target)
+    time.sleep(wait)
+
+    ensure_claim_partitions(shards[target])
+    _delete_user_rows(shards[target], user_id)
+    copied = _copy_user_rows(shards[source], shards[target], user_id)
+    shards[target].commit()
+    shards[source].rollback()
+
+    _pin(directory, user_id, target)
+    time.sleep(wait)
+
+    _delete_user_rows(shards[source], user_id)
+    shards[source].commit()
+    return {"user_id": str(user_id), "from": source, "to": target, "moved": True, "rows": copied}
+
+
+def pin_users(directory: Connection, shards: dict[str, Connection]) -> dict[str, int]:
+    """Pin users to the shard holding their rows where the hash ring now points elsewhere.
+
+    Run this after adding a shard to SHARDS and before serving traffic with the new
+    configuration; then ``move`` pinned users over at leisure. Users already in the directory
+    are left alone.
+    """
+    pinned: dict[str, int] = {}
+    for name, conn in shards.items():
+        pinned[name] = 0
+        for user_id in conn.scalars(select(Entity.user_id).distinct()):
+            if shard_router.ring.shard_for(user_id) == name:
+                continue
+            result = directory.execute(
+                pg_insert(UserShard).values(user_id=user_id, shard=name).on_conflict_do_nothing()
+            )
+            pinned[name] += result.rowcount
+        directory.commit()
+        conn.rollback()
+    return pinned
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.sharding", description="User shard administration.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    where = commands.add_parser("where", help="show which shard serves a user")
+    where.add_argument("user_id", type=uuid.UUID)
+
+    move = commands.add_parser("move", help="move a user's rows to another shard")
+    move.add_argument("user_id", type=uuid.UUID)
+    move.add_argument("target")
+
+    commands.add_parser("pin", help="pin users whose rows are not where the hash ring now points")
+
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine
+
+    from app.db import engine, engine_options
+
+    shard_engines = {
+        name: engine if url == settings.database_url else create_engine(url, **engine_options())
+        for name, url in SHARD_URLS.items()
+    }
+    try:
+        with engine.connect() as directory:
+            if args.command == "where":
+                result = _directory_assignment(directory, args.user_id)._asdict()
+            else:
+                connections = {name: shard_engine.connect() for name, shard_engine in shard_engines.items()}
+                try:
+                    if args.command == "move":
+                        result = move_user(directory, connections, args.user_id, args.target)
+                    else:
+                        result = pin_users(directory, connections)
+                finally:
+                    for conn in connections.values():
+                        conn.close()
+    finally:
+        for shard_engine in {*shard_engines.values(), engine}:
+            shard_engine.dispose()
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,35 @@
+import gzip
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import HTMLResponse, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth import require_grant
-from app.db import get_db
+from app import crud
+from app.admission import AdmittedStreamingResponse, enter
+from app.auth import require_scope
+from app.cache import CACHED_HEADERS, read_cache
+from app.grant_cache import CachedGrant
 from app.models import Entity
-from app.schemas import EntityOut
+from app.responses import RowJSONResponse, entity_item, http_date, not_modified
+from app.schemas import MAX_PROJECTED_FIELDS, EntityOut, EntityPage
+from app.sharding import get_user_read_db, shard_router
+
+try:
+    import brotli
+except ImportError:  # optional: without it the UI is served gzip or uncompressed
+    brotli = None
 
 router = APIRouter()
 
 
-@router.get("/ui", response_class=HTMLResponse)
-def ui_page() -> str:
-    return """<!doctype html>
+UI_HTML = """<!doctype html>
 <html lang=\"en\">
 <head>
   <meta charset=\"UTF-8\" />
@@ -123,14 +138,14 @@ def ui_page() -> str:
           <input id=\"entitiesType\" placeholder=\"contact\" />
         </div>
         <div>
-          <label>Limit / Offset</label>
-          <div class=\"row two\">
-            <input id=\"entitiesLimit\" type=\"number\" value=\"50\" />
-            <input id=\"entitiesOffset\" type=\"number\" value=\"0\" />
-          </div>
+          <label>Limit</label>
+          <input id=\"entitiesLimit\" type=\"number\" value=\"50\" />
         </div>
       </div>
-      <p><button id=\"loadEntities\">Load Entities</button></p>
+      <p>
+        <button id=\"loadEntities\">Load Entities</button>
+        <button class=\"secondary\" id=\"nextEntities\" disabled>Next page</button>
+      </p>
       <div class=\"row two\">
         <div class=\"entity-list\" id=\"entityList\"></div>
         <pre id=\"entityDetail\">Select an entity…</pre>
@@ -138,8 +153,14 @@ def ui_page() -> str:
     </div>
 
     <div id=\"claims\" class=\"tab panel\">
-      <p><button id=\"loadClaims\">Load Proposed Claims</button></p>
+      <p>
+        <button id=\"loadClaims\">Load Proposed Claims</button>
+        <button class=\"secondary\" id=\"confirmAllClaims\">Confirm all loaded</button>
+        <button class=\"secondary\" id=\"rejectAllClaims\">Reject all loaded</button>
+        <span id=\"claimsLive\" class=\"muted\">Not live</span>
+      </p>
       <div id=\"claimsTableWrap\" class=\"muted\">No claims loaded.</div>
+      <p><button class=\"secondary\" id=\"moreClaims\" style=\"display:none\">Load more</button></p>
     </div>
 
     <div id=\"write\" class=\"tab panel\">
@@ -232,15 +253,19 @@ def ui_page() -> str:
       };
     });
 
-    document.getElementById('loadEntities').onclick = async () => {
+    let entitiesCursor = null;
+
+    async function loadEntities(cursor) {
       const type = document.getElementById('entitiesType').value.trim();
       const limit = Number(document.getElementById('entitiesLimit').value || 50);
-      const offset = Number(document.getElementById('entitiesOffset').value || 0);
       const qs = new URLSearchParams();
       if (type) qs.set('type', type);
       qs.set('limit', String(limit));
-      qs.set('offset', String(offset));
-      const entities = await apiFetch(`/api/entities?${qs.toString()}`);
+      if (cursor) qs.set('cursor', cursor);
+      const page = await apiFetch(`/api/entities?${qs.toString()}`);
+      const entities = page.items;
+      entitiesCursor = page.next_cursor;
+      document.getElementById('nextEntities').disabled = !entitiesCursor;
       const list = document.getElementById('entityList');
       const detail = document.getElementById('entityDetail');
       list.innerHTML = '';
@@ -261,11 +286,34 @@ def ui_page() -> str:
         };
         list.appendChild(item);
       }
-    };
+    }
+
+    document.getElementById('loadEntities').onclick = () => loadEntities(null);
+    document.getElementById('nextEntities').onclick = () => loadEntities(entitiesCursor);
+
+    let claims = [];
+    let claimsCursor = null;
+    let claimStream = null;
+
+    async function refreshClaims(append = false) {
+      const more = document.getElementById('moreClaims');
+      const qs = new URLSearchParams({status_filter: 'proposed'});
+      if (append && claimsCursor) qs.set('cursor', claimsCursor);
+      const page = await apiFetch(`/claims?${qs.toString()}`);
+      claims = append ? claims.concat(page.items) : page.items;
+      claimsCursor = page.next_cursor;
+      more.style.display = claimsCursor ? '' : 'none';
+      renderClaims();
+    }
+
+    function dropClaims(ids) {
+      const gone = new Set(ids);
+      claims = claims.filter(c => !gone.has(c.id));
+      renderClaims();
+    }
 
-    async function refreshClaims() {
+    function renderClaims() {
       const wrap = document.getElementById('claimsTableWrap');
-      const claims = await apiFetch('/claims?status_filter=proposed');
       if (!claims.length) {
         wrap.innerHTML = '<p class="muted">No proposed claims.</p>';
         return;
@@ -279,7 +327,10 @@ def ui_page() -> str:
           <td>${c.field}</td>
           <td><pre>${JSON.stringify(c.old_value, null, 2)}</pre></td>
           <td><pre>${JSON.stringify(c.new_value, null, 2)}</pre></td>
-          <td><button data-confirm="${c.id}">Confirm</button></td>
+          <td>
+            <button data-confirm="${c.id}">Confirm</button>
+            <button class="secondary" data-reject="${c.id}">Reject</button>
+          </td>
         </tr>`;
       }
       html += '</tbody></table>';
@@ -290,23 +341,117 @@ def ui_page() -> str:
           btn.disabled = true;
           try {
             await apiFetch(`/claims/${btn.dataset.confirm}/confirm`, {method: 'POST'});
-            await refreshClaims();
+            dropClaims([btn.dataset.confirm]);
           } catch (e) {
             alert(e.message);
             btn.disabled = false;
           }
         };
       });
+
+      wrap.querySelectorAll('button[data-reject]').forEach(btn => {
+        btn.onclick = async () => {
+          btn.disabled = true;
+          try {
+            await apiFetch('/claims/reject', {method: 'POST', body: JSON.stringify({claim_ids: [btn.dataset.reject]})});
+            dropClaims([btn.dataset.reject]);
+          } catch (e) {
+            alert(e.message);
+            btn.disabled = false;
+          }
+        };
+      });
+    }
+
+    async function resolveLoadedClaims(action) {
+      if (!claims.length) return;
+      try {
+        const res = await apiFetch(`/claims/${action}`, {method: 'POST', body: JSON.stringify({claim_ids: claims.map(c => c.id)})});
+        dropClaims(res.claims.map(c => c.id));
+      } catch (e) {
+        alert(e.message);
+      }
+    }
+
+    function setClaimsLive(msg, ok) {
+      document.getElementById('claimsLive').innerHTML = `<span class="${ok ? 'ok' : 'muted'}">${msg}</span>`;
+    }
+
+    function onClaimEvent(event, data) {
+      if (event === 'ready' || event === 'resync') {
+        refreshClaims().catch(e => alert(e.message));
+      } else if (event === 'proposed') {
+        const known = new Set(claims.map(c => c.id));
+        const fresh = data.claims.filter(c => !known.has(c.id)).reverse();
+        claims = fresh.concat(claims);
+        renderClaims();
+      } else if (event === 'resolved') {
+        dropClaims(data.ids);
+      }
+    }
+
+    // EventSource cannot send an Authorization header, so the SSE stream is read via fetch.
+    async function startClaimStream() {
+      const token = (localStorage.getItem('ontology_token') || tokenInput.value || '').trim();
+      if (!token) throw new Error('Set bearer token first.');
+      claimStream = new AbortController();
+      const res = await fetch('/claims/stream', {headers: {'Authorization': `Bearer ${token}`}, signal: claimStream.signal});
+      if (!res.ok) {
+        claimStream = null;
+        throw new Error(`${res.status} ${res.statusText}: ${await res.text()}`);
+      }
+      setClaimsLive('Live', true);
+      (async () => {
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        try {
+          while (true) {
+            const {value, done} = await reader.read();
+            if (done) break;
+            buffer += value;
+            let split;
+            while ((split = buffer.indexOf('\\n\\n')) >= 0) {
+              const frame = buffer.slice(0, split);
+              buffer = buffer.slice(split + 2);
+              let event = 'message';
+              let data = '';
+              for (const line of frame.split('\\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+              }
+              if (data) onClaimEvent(event, JSON.parse(data));
+            }
+          }
+        } catch (e) {
+          if (e.name === 'AbortError') return;
+        }
+        // The server ends streams periodically; reconnect (which also reloads the list).
+        setClaimsLive('Reconnecting…', false);
+        claimStream = null;
+        setTimeout(() => startClaimStream().catch(() => setClaimsLive('Disconnected', false)), 3000);
+      })();
     }
 
+    document.getElementById('confirmAllClaims').onclick = () => resolveLoadedClaims('confirm');
+    document.getElementById('rejectAllClaims').onclick = () => resolveLoadedClaims('reject');
+
     document.getElementById('loadClaims').onclick = async () => {
       try {
-        await refreshClaims();
+        if (claimStream) await refreshClaims();
+        else await startClaimStream();
       } catch (e) {
         document.getElementById('claimsTableWrap').innerHTML = `<p class=\"err\">${e.message}</p>`;
       }
     };
 
+    document.getElementById('moreClaims').onclick = async () => {
+      try {
+        await refreshClaims(true);
+      } catch (e) {
+        alert(e.message);
+      }
+    };
+
     document.getElementById('submitWrite').onclick = async () => {
       const out = document.getElementById('writeResult');
       try {
@@ -358,32 +503,187 @@ def ui_page() -> str:
 </body>
 </html>"""
 
+UI_CACHE_CONTROL = "public, max-age=300"
+# Entity reads must be revalidated every time; the ETag makes that a cheap 304.
+ENTITY_CACHE_CONTROL = "private, no-cache"
+
+
+def _ui_variants() -> dict[str, tuple[bytes, str]]:
+    """The UI page per content coding with its ETag, compressed once at import."""
+    body = UI_HTML.encode()
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    variants = {"identity": (body, f'"{digest}"'), "gzip": (gzip.compress(body, 9, mtime=0), f'"{digest}-gzip"')}
+    if brotli is not None:
+        variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+    return variants
+
+
+UI_VARIANTS = _ui_variants()
+
+
+def _accepted_codings(accept_encoding: str) -> set[str]:
+    codings = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        codings.add(coding.strip().lower())
+    return codings
+
+
+@router.get("/ui", response_class=HTMLResponse)
+async def ui_page(request: Request) -> Response:
+    accepted = _accepted_codings(request.headers.get("accept-encoding", ""))
+    coding = next((c for c in ("br", "gzip") if c in UI_VARIANTS and c in accepted), "identity")
+    body, etag = UI_VARIANTS[coding]
+    headers = {"ETag": etag, "Cache-Control": UI_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    unchanged = not_modified(request, headers)
+    if unchanged:
+        # A 304 has no body, so it carries no Content-Encoding.
+        return unchanged
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return HTMLResponse(body, headers=headers)
+
+
+def _entity_validators(entity) -> dict[str, str]:
+    return {
+        "ETag": f'W/"{entity.id}.{entity.version}"',
+        "Last-Modified": http_date(entity.updated_at),
+        "Cache-Control": ENTITY_CACHE_CONTROL,
+    }
+
+
+def _page_etag(entities, next_cursor: str | None) -> str:
+    digest = hashlib.sha256()
+    for entity in entities:
+        digest.update(f"{entity.id}.{entity.version};".encode())
+    digest.update((next_cursor or "").encode())
+    return f'W/"{digest.hexdigest()[:32]}"'
 
-@router.get("/api/entities", response_model=list[EntityOut])
-def list_entities(
+
+def _parse_fields(fields: str | None) -> list[str] | None:
+    """``fields=name,email`` -> ``["name", "email"]``; absent or blank means the whole document."""
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if len(names) > MAX_PROJECTED_FIELDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_PROJECTED_FIELDS} fields may be requested"
+        )
+    return names or None
+
+
+@router.get("/api/entities", response_model=EntityPage)
+async def list_entities(
     request: Request,
     type: str | None = None,
     limit: int = 50,
-    offset: int = 0,
-    db: Session = Depends(get_db),
-    _grant=Depends(require_grant),
+    cursor: str | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(get_user_read_db),
+    _grant=Depends(require_scope("read")),
 ):
-    query = db.query(Entity).filter(Entity.user_id == request.state.user_id)
-    if type:
-        query = query.filter(Entity.type == type)
-
-    entities = query.order_by(Entity.updated_at.desc()).offset(max(offset, 0)).limit(min(max(limit, 1), 200)).all()
-    return [EntityOut(id=e.id, type=e.type, data=e.data) for e in entities]
+    try:
+        entities, next_cursor = await crud.list_entities(
+            db=db,
+            user_id=request.state.user_id,
+            entity_type=type,
+            limit=min(max(limit, 1), 200),
+            cursor=cursor,
+            fields=_parse_fields(fields),
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    # The page changes when any listed entity does, or when entities are added ahead of it.
+    headers = {"ETag": _page_etag(entities, next_cursor), "Cache-Control": ENTITY_CACHE_CONTROL}
+    return not_modified(request, headers) or RowJSONResponse(
+        {"items": [entity_item(e) for e in entities], "next_cursor": next_cursor}, headers=headers
+    )
 
 
 @router.get("/api/entity/{entity_id}", response_model=EntityOut)
-def get_entity(
+async def get_entity(
     entity_id: UUID,
     request: Request,
-    db: Session = Depends(get_db),
-    _grant=Depends(require_grant),
+    fields: str | None = None,
+    db: AsyncSession = Depends(get_user_read_db),
+    _grant=Depends(require_scope("read")),
 ):
-    entity = db.query(Entity).filter(Entity.id == entity_id, Entity.user_id == request.state.user_id).first()
+    projection = _parse_fields(fields)
+    cache_key = read_cache.key(request.state.user_id, "entity", f"{entity_id}:{projection}")
+    cached = read_cache.get(cache_key, "entity")
+    if cached is not None:
+        validators = {name: cached.headers[name] for name in CACHED_HEADERS if name in cached.headers}
+        return not_modified(request, validators) or cached
+
+    stmt = select(*crud.entity_columns(projection), Entity.version, Entity.updated_at).where(
+        Entity.id == entity_id, Entity.user_id == request.state.user_id
+    )
+    entity = (await db.execute(stmt)).first()
     if not entity:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entity not found")
-    return EntityOut(id=entity.id, type=entity.type, data=entity.data)
+    headers = _entity_validators(entity)
+    unchanged = not_modified(request, headers)
+    if unchanged is not None:
+        return unchanged
+    response = RowJSONResponse(entity_item(entity), headers=headers)
+    read_cache.set(cache_key, response, db)
+    return response
+
+
+EXPORT_KINDS = {"entities": "entity", "claims": "claim", "claim_history": "claim_history"}
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _ndjson_line(kind: str, row) -> bytes:
+    return json.dumps({"kind": EXPORT_KINDS[kind], **row._asdict()}, default=_json_default).encode() + b"\n"
+
+
+async def _export_stream(user_id, include: list[str], compress: bool):
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    # A dedicated read-only snapshot: the request-scoped session is gone by the time the
+    # body streams, and entities and claims should be mutually consistent. This holds one
+    # read connection for the whole stream; keyset pages would give up the snapshot and need
+    # extra (user_id, id) indexes on the write-hot tables.
+    async with shard_router.read_session(user_id) as db:
+        await db.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+        async for kind, rows in crud.export_rows(db, user_id, include):
+            chunk = b"".join(_ndjson_line(kind, row) for row in rows)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    if compressor:
+        yield compressor.flush()
+
+
+@router.get("/api/export")
+async def export_vault(
+    request: Request,
+    include: list[Literal["entities", "claims", "claim_history"]] = Query(
+        default=["entities", "claims", "claim_history"]
+    ),
+    compress: bool = Query(default=False, alias="gzip"),
+    grant: CachedGrant = Depends(require_scope("read")),
+):
+    headers = {"Content-Disposition": 'attachment; filename="vault.ndjson"', "Cache-Control": "private, no-store"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    # The slot must cover the stream, which holds its own shard connection.
+    key = await enter(request, grant)
+    return AdmittedStreamingResponse(
+        _export_stream(grant.user_id, list(dict.fromkeys(include)), compress),
+        key,
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
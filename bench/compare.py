@@ -0,0 +1,40 @@
+"""Diff two ``bench.load`` reports per endpoint.
+
+    python -m bench.compare baseline.json candidate.json
+"""
+
+import argparse
+import json
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def compare(baseline: dict, candidate: dict) -> dict:
+    result = {}
+    for endpoint in sorted(set(baseline["endpoints"]) | set(candidate["endpoints"])):
+        before = baseline["endpoints"].get(endpoint, {})
+        after = candidate["endpoints"].get(endpoint, {})
+        row = {}
+        for metric in METRICS:
+            old, new = before.get(metric), after.get(metric)
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            row[metric] = {"baseline": old, "candidate": new, "change_pct": change}
+        result[endpoint] = row
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    with open(args.candidate, encoding="utf-8") as fh:
+        candidate = json.load(fh)
+    print(json.dumps(compare(baseline, candidate), indent=2))
+
+
+if __name__ == "__main__":
+    main()
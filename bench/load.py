@@ -0,0 +1,177 @@
+"""Concurrent load generator for the main endpoints against a seeded vault.
+
+Reads the manifest written by ``bench.seed``, runs a weighted mix of requests from many
+concurrent workers (each request uses a random client token of a random user) and writes
+per-endpoint throughput and latency percentiles as JSON, so runs can be diffed between releases.
+
+    python -m bench.load --base-url http://127.0.0.1:8000 --profile mixed --concurrency 32 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+PROFILES: dict[str, dict[str, int]] = {
+    "read": {"query": 50, "entities": 25, "claims": 20, "write": 5},
+    "mixed": {"query": 35, "entities": 15, "claims": 15, "write": 35},
+    "write": {"query": 10, "entities": 5, "claims": 5, "write": 80},
+}
+
+ENDPOINTS = {"query": "/query", "entities": "/api/entities", "claims": "/claims", "write": "/write"}
+
+
+class Scenario:
+    def __init__(self, manifest: dict, rng: random.Random):
+        self.users = manifest["users"]
+        self.entity_count = manifest["entities_per_user"]
+        self.orgs = manifest["orgs"]
+        self.rng = rng
+
+    def headers(self) -> dict[str, str]:
+        user = self.rng.choice(self.users)
+        token = self.rng.choice(user["tokens"])["token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    def _seq(self) -> int:
+        return self.rng.randint(1, max(self.entity_count, 1))
+
+    async def query(self, client: httpx.AsyncClient) -> httpx.Response:
+        mode = self.rng.choice(["substring", "prefix", "fuzzy"])
+        q = f"Contact {self._seq()}" if mode != "substring" else f"Org {self.rng.randrange(self.orgs)}"
+        return await client.post("/query", json={"q": q, "mode": mode, "max_results": 10}, headers=self.headers())
+
+    async def entities(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get("/api/entities", params={"limit": 50}, headers=self.headers())
+
+    async def claims(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get("/claims", params={"limit": 100}, headers=self.headers())
+
+    async def write(self, client: httpx.AsyncClient) -> httpx.Response:
+        # Mostly existing contacts (fill-empty / propose path), some brand new ones.
+        seq = self._seq() if self.rng.random() < 0.8 else self.entity_count + self.rng.randint(1, 10**9)
+        payload = {
+            "entity_type": "contact",
+            "match": {"email": f"c{seq}@example.com"},
+            "patch": {"phone": f"+1-555-{self.rng.randrange(10**4):04d}", "org": f"Org {self.rng.randrange(self.orgs)}"},
+        }
+        return await client.post("/write", json=payload, headers=self.headers())
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile.
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(values, 50) * 1000, 2),
+        "p95_ms": round(_percentile(values, 95) * 1000, 2),
+        "p99_ms": round(_percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+async def _worker(client, scenario: Scenario, weights: dict[str, int], deadline: float, record) -> None:
+    ops = list(weights)
+    op_weights = list(weights.values())
+    while time.perf_counter() < deadline:
+        op = scenario.rng.choices(ops, weights=op_weights)[0]
+        started = time.perf_counter()
+        try:
+            response = await getattr(scenario, op)(client)
+            failed = response.status_code >= 400
+            status_code = response.status_code
+        except httpx.HTTPError as exc:
+            failed, status_code = True, type(exc).__name__
+        record(op, time.perf_counter() - started, failed, status_code)
+
+
+async def run(manifest: dict, base_url: str, profile: str, concurrency: int, duration: float, warmup: float, seed: int) -> dict:
+    weights = PROFILES[profile]
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    statuses: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    recording = False
+
+    def record(op: str, elapsed: float, failed: bool, status_code) -> None:
+        if not recording:
+            return
+        latencies[op].append(elapsed)
+        statuses[op][str(status_code)] += 1
+        if failed:
+            errors[op] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        scenarios = [Scenario(manifest, random.Random(seed + n)) for n in range(concurrency)]
+        if warmup > 0:
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*[_worker(client, s, weights, deadline, record) for s in scenarios])
+
+        recording = True
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*[_worker(client, s, weights, deadline, record) for s in scenarios])
+        elapsed = time.perf_counter() - started
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "base_url": base_url,
+        "profile": profile,
+        "weights": weights,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "dataset": {
+            "users": len(manifest["users"]),
+            "entities_per_user": manifest["entities_per_user"],
+            "clients_per_user": len(manifest["users"][0]["tokens"]) if manifest["users"] else 0,
+        },
+        "endpoints": {
+            ENDPOINTS[op]: {**_summary(latencies[op], errors[op], elapsed), "status": dict(statuses[op])}
+            for op in weights
+        },
+        "total": _summary(everything, sum(errors.values()), elapsed),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--manifest", default="bench/seed.json")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    with open(args.manifest, encoding="utf-8") as fh:
+        manifest = json.load(fh)
+    report = asyncio.run(
+        run(manifest, args.base_url, args.profile, args.concurrency, args.duration, args.warmup, args.seed)
+    )
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Seed a local Postgres with synthetic users, entities, claims and grants for load tests.
+
+Rows are generated set-wise in SQL, so 10^7 entities is a matter of minutes rather than hours.
+The grant tokens and dataset shape are written to a manifest that ``bench.load`` reads.
+
+    python -m bench.seed --users 100 --entities-per-user 10000 --clients-per-user 3
+"""
+
+import argparse
+import json
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, insert, text
+
+from app.db import SHARD_URLS, Base, engine, engine_options
+from app.maintenance import ensure_claim_partitions
+from app.models import DIRECTORY_TABLES, SHARD_TABLES, Grant
+from app.settings import settings
+from app.sharding import shard_router
+
+ORGS = 500
+
+SEED_ENTITIES = """
+INSERT INTO entities (id, user_id, type, data, version, created_at, updated_at)
+SELECT
+    gen_random_uuid(),
+    u.user_id,
+    'contact',
+    jsonb_build_object(
+        'name', 'Contact ' || g,
+        'email', 'c' || g || '@example.com',
+        'org', 'Org ' || (g % :orgs)
+    ),
+    1,
+    now() - make_interval(secs => g),
+    now() - make_interval(secs => g)
+FROM unnest(CAST(:user_ids AS uuid[])) AS u(user_id)
+CROSS JOIN generate_series(1, :entities) AS g
+"""
+
+# Mirrors crud.match_keys for contacts: the normalized email and name.
+SEED_KEYS = """
+INSERT INTO entity_keys (user_id, type, key, entity_id)
+SELECT e.user_id, e.type, k.key, e.id
+FROM entities e
+CROSS JOIN LATERAL (VALUES ('email:' || lower(e.data ->> 'email')), ('name:' || lower(e.data ->> 'name'))) AS k(key)
+WHERE e.user_id = ANY(CAST(:user_ids AS uuid[]))
+"""
+
+SEED_CLAIMS = """
+INSERT INTO claims (id, user_id, client_id, entity_id, entity_type, field, old_value, new_value, status, created_at)
+SELECT
+    gen_random_uuid(),
+    e.user_id,
+    'client-' || (c % :clients),
+    e.id,
+    e.type,
+    'org',
+    e.data -> 'org',
+    to_jsonb('Seeded Org ' || c),
+    CASE WHEN c % 4 = 0 THEN 'confirmed' ELSE 'proposed' END,
+    now() - make_interval(secs => c)
+FROM entities e
+CROSS JOIN generate_series(1, :claims_per_entity) AS c
+WHERE e.user_id = ANY(CAST(:user_ids AS uuid[])) AND random() < :claim_ratio
+"""
+
+
+def _batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def seed(users: int, entities_per_user: int, claim_ratio: float, claims_per_entity: int, clients_per_user: int, batch_rows: int) -> dict:
+    shard_engines = {
+        name: engine if url == settings.database_url else create_engine(url, **engine_options())
+        for name, url in SHARD_URLS.items()
+    }
+    try:
+        return _seed(shard_engines, users, entities_per_user, claim_ratio, claims_per_entity, clients_per_user, batch_rows)
+    finally:
+        for shard_engine in {*shard_engines.values(), engine}:
+            shard_engine.dispose()
+
+
+def _seed(shard_engines: dict, users: int, entities_per_user: int, claim_ratio: float, claims_per_entity: int, clients_per_user: int, batch_rows: int) -> dict:
+    Base.metadata.create_all(engine, tables=DIRECTORY_TABLES)
+    for shard_engine in shard_engines.values():
+        Base.metadata.create_all(shard_engine, tables=SHARD_TABLES)
+        with shard_engine.begin() as conn:
+            ensure_claim_partitions(conn)
+
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    expires_at = datetime.now(timezone.utc) + timedelta(days=30)
+    manifest_users = []
+    grants = []
+    for user_id in user_ids:
+        tokens = []
+        for n in range(clients_per_user):
+            token = secrets.token_urlsafe(32)
+            client_id = f"client-{n}"
+            grants.append(
+                {
+                    "user_id": user_id,
+                    "client_id": client_id,
+                    "scopes": ["read", "write"],
+                    "token": token,
+                    "expires_at": expires_at,
+                }
+            )
+            tokens.append({"client_id": client_id, "token": token})
+        manifest_users.append({"user_id": str(user_id), "tokens": tokens})
+
+    started = time.perf_counter()
+    users_per_batch = max(1, batch_rows // max(entities_per_user, 1))
+    with engine.begin() as conn:
+        conn.execute(insert(Grant), grants)
+
+    # New users have no directory entry, so the hash ring decides where their rows live.
+    users_by_shard: dict[str, list[uuid.UUID]] = {}
+    for user_id in user_ids:
+        users_by_shard.setdefault(shard_router.ring.shard_for(user_id), []).append(user_id)
+
+    for shard, shard_user_ids in users_by_shard.items():
+        for chunk in _batches(shard_user_ids, users_per_batch):
+            with shard_engines[shard].begin() as conn:
+                params = {"user_ids": chunk}
+                conn.execute(text(SEED_ENTITIES), {**params, "entities": entities_per_user, "orgs": ORGS})
+                conn.execute(text(SEED_KEYS), params)
+                if claim_ratio > 0 and claims_per_entity > 0:
+                    conn.execute(
+                        text(SEED_CLAIMS),
+                        {**params, "clients": clients_per_user, "claim_ratio": claim_ratio, "claims_per_entity": claims_per_entity},
+                    )
+
+    for shard_engine in shard_engines.values():
+        with shard_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM ANALYZE entities"))
+            conn.execute(text("VACUUM ANALYZE entity_keys"))
+            conn.execute(text("VACUUM ANALYZE claims"))
+
+    return {
+        "entities_per_user": entities_per_user,
+        "claim_ratio": claim_ratio,
+        "claims_per_entity": claims_per_entity,
+        "orgs": ORGS,
+        "seed_seconds": round(time.perf_counter() - started, 2),
+        "users": manifest_users,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--entities-per-user", type=int, default=10_000)
+    parser.add_argument("--claim-ratio", type=float, default=0.1, help="fraction of entities that get claims")
+    parser.add_argument("--claims-per-entity", type=int, default=2)
+    parser.add_argument("--clients-per-user", type=int, default=2)
+    parser.add_argument("--batch-rows", type=int, default=1_000_000, help="entities inserted per transaction")
+    parser.add_argument("--out", default="bench/seed.json")
+    args = parser.parse_args()
+
+    manifest = seed(
+        users=args.users,
+        entities_per_user=args.entities_per_user,
+        claim_ratio=args.claim_ratio,
+        claims_per_entity=args.claims_per_entity,
+        clients_per_user=args.clients_per_user,
+        batch_rows=args.batch_rows,
+    )
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2)
+    total = len(manifest["users"]) * args.entities_per_user
+    print(f"seeded {len(manifest['users'])} users / {total} entities in {manifest['seed_seconds']}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
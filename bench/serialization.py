@@ -0,0 +1,127 @@
+"""Per-page CPU cost of serializing entity and claim list responses.
+
+Compares the previous path (ORM objects -> per-row Pydantic models -> FastAPI's
+``response_model`` validation -> stdlib JSON) with ``RowJSONResponse`` over selected
+column rows. No database is needed; rows are synthesized in memory.
+
+    python -m bench.serialization --rows 200 --pages 500
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+
+from app.crud import CLAIM_OUT_COLUMNS, ENTITY_OUT_COLUMNS
+from app.models import Claim, Entity
+from app.responses import RowJSONResponse, claim_item, entity_item
+from app.schemas import ClaimOut, ClaimPage, EntityOut, EntityPage
+
+
+def _entity_values(i: int) -> dict:
+    return {
+        "id": uuid.uuid4(),
+        "type": "contact",
+        "data": {"name": f"Contact {i}", "email": f"c{i}@example.com", "org": "Acme", "tags": ["a", "b"]},
+    }
+
+
+def _claim_values(i: int) -> dict:
+    return {
+        "id": uuid.uuid4(),
+        "user_id": uuid.uuid4(),
+        "client_id": "bench",
+        "entity_id": uuid.uuid4(),
+        "entity_type": "contact",
+        "field": "org",
+        "old_value": "Acme",
+        "new_value": f"Org {i}",
+        "status": "proposed",
+        "created_at": datetime.now(timezone.utc),
+        "confirmed_at": None,
+    }
+
+
+def _rows(columns, values: list[dict]) -> list:
+    # Build real SQLAlchemy Row objects shaped like the selected-column results.
+    keys = [column.key for column in columns]
+    metadata = SimpleResultMetaData(keys)
+    return list(IteratorResult(metadata, iter([tuple(v[k] for k in keys) for v in values])))
+
+
+_loop = asyncio.new_event_loop()
+
+
+def _before(model_field, page) -> bytes:
+    content = _loop.run_until_complete(serialize_response(field=model_field, response_content=page))
+    return JSONResponse(content).body
+
+
+def _measure(fn, pages: int) -> float:
+    start = time.process_time()
+    for _ in range(pages):
+        fn()
+    return (time.process_time() - start) / pages * 1000
+
+
+def run(rows: int, pages: int) -> dict:
+    entity_values = [_entity_values(i) for i in range(rows)]
+    claim_values = [_claim_values(i) for i in range(rows)]
+    entity_orm = [Entity(**v) for v in entity_values]
+    claim_orm = [Claim(**v) for v in claim_values]
+    entity_rows = _rows(ENTITY_OUT_COLUMNS, entity_values)
+    claim_rows = _rows(CLAIM_OUT_COLUMNS, claim_values)
+
+    entity_field = create_model_field(name="response", type_=EntityPage, mode="serialization")
+    claim_field = create_model_field(name="response", type_=ClaimPage, mode="serialization")
+
+    def entities_before():
+        items = [EntityOut(id=e.id, type=e.type, data=e.data) for e in entity_orm]
+        return _before(entity_field, EntityPage(items=items, next_cursor="x"))
+
+    def entities_after():
+        return RowJSONResponse({"items": [entity_item(e) for e in entity_rows], "next_cursor": "x"}).body
+
+    def claims_before():
+        items = [ClaimOut.model_validate(c) for c in claim_orm]
+        return _before(claim_field, ClaimPage(items=items, next_cursor="x"))
+
+    def claims_after():
+        return RowJSONResponse({"items": [claim_item(c) for c in claim_rows], "next_cursor": "x"}).body
+
+    assert json.loads(entities_before()) == json.loads(entities_after())
+    assert json.loads(claims_before()) == json.loads(claims_after())
+
+    results = {}
+    for name, before, after in (
+        ("entities", entities_before, entities_after),
+        ("claims", claims_before, claims_after),
+    ):
+        before_ms = _measure(before, pages)
+        after_ms = _measure(after, pages)
+        results[name] = {
+            "before_ms_per_page": round(before_ms, 3),
+            "after_ms_per_page": round(after_ms, 3),
+            "speedup": round(before_ms / after_ms, 2),
+        }
+    return {"rows_per_page": rows, "pages": pages, "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.pages), indent=2))
+
+
+if __name__ == "__main__":
+    main()
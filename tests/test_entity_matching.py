@@ -0,0 +1,66 @@
+"""Entity matching through identity keys; needs the Postgres at DATABASE_URL."""
+
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.db import engine
+from app.main import app
+
+
+@pytest.fixture
+def client():
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError:
+        pytest.skip("no database at DATABASE_URL")
+    with TestClient(app) as client:
+        grant = {"user_id": str(uuid.uuid4()), "client_id": "tests", "scopes": ["read", "write"]}
+        token = client.post("/dev/grants", json=grant).json()["token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+
+
+def write(client, match, patch=None) -> str:
+    response = client.post("/write", json={"entity_type": "contact", "match": match, "patch": patch or {}})
+    assert response.status_code == 200, response.text
+    return response.json()["entity_id"]
+
+
+def test_name_variants_still_match_after_email_is_filled(client):
+    alice = write(client, {"name": "Alice"})
+    assert write(client, {"name": "Alice"}, {"email": "alice@example.com"}) == alice
+
+    assert write(client, {"name": "ALICE"}, {"org": "Acme"}) == alice
+    assert write(client, {"name": "Alice"}) == alice
+    assert write(client, {"email": " Alice@Example.com"}) == alice
+
+    batch = client.post(
+        "/write/batch",
+        json={"items": [{"entity_type": "contact", "match": {"name": " alice "}, "patch": {"phone": "1"}}]},
+    )
+    assert batch.json()["results"][0]["entity_id"] == alice
+
+    rows = json.dumps({"entity_type": "contact", "match": {"name": "aLiCe"}, "patch": {"title": "CTO"}})
+    imported = client.post("/import", content=rows, headers={"Content-Type": "application/x-ndjson"})
+    assert imported.json()["entities_created"] == 0
+
+    items = client.get("/api/entities").json()["items"]
+    assert [item["id"] for item in items] == [alice]
+    assert items[0]["data"]["title"] == "CTO"
+
+
+def test_confirmed_email_replaces_the_old_key(client):
+    alice = write(client, {"email": "alice@example.com"}, {"name": "Alice"})
+    claim_id = client.post(
+        "/write", json={"entity_type": "contact", "match": {"name": "alice"}, "patch": {"email": "a@example.com"}}
+    ).json()["proposed"][0]["claim_id"]
+    assert client.post(f"/claims/{claim_id}/confirm").status_code == 200
+
+    assert write(client, {"email": "A@example.com"}) == alice
+    assert write(client, {"email": "alice@example.com"}) != alice